@@ -1,6 +1,96 @@
+import uuid
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils.functional import cached_property
+
+from .models import Quiz, QuizQuestion, Question, Answer, Tracker, ExportJob
+
+
+class EstimatedCountPaginator(Paginator):
+
+    """
+    Uses Postgres' row estimates instead of COUNT(*) for large
+    changelists: pg_class.reltuples when unfiltered, the planner's row
+    estimate when filtered. Exact counts are still used when the estimate
+    is small enough for them to be cheap.
+    """
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table])
+                estimate = cursor.fetchone()[0]
+            else:
+                try:
+                    sql, params = queryset.query.sql_with_params()
+                except EmptyResultSet:
+                    return 0
+                cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+                estimate = cursor.fetchone()[0][0]['Plan']['Plan Rows']
+        if estimate > self.exact_count_limit:
+            return int(estimate)
+        return super(EstimatedCountPaginator, self).count
+
+
+class InputFilter(admin.SimpleListFilter):
+
+    """
+    A list filter for an id, rendered as a text box rather than listing
+    every related object in the sidebar
+    """
+    template = 'admin/quizzes/input_filter.html'
+    field = None
+
+    def lookups(self, request, model_admin):
+        # A single dummy lookup so the filter is shown
+        return ((None, None),)
+
+    def choices(self, changelist):
+        all_choice = next(super(InputFilter, self).choices(changelist))
+        all_choice['query_parts'] = [
+            (key, value)
+            for key, value in changelist.get_filters_params().items()
+            if key != self.parameter_name]
+        yield all_choice
 
-from .models import Quiz, Question, Answer, Tracker
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        try:
+            value = uuid.UUID(self.value().strip())
+        except ValueError:
+            return queryset.none()
+        return queryset.filter(**{self.field: value})
+
+
+class QuestionFilter(InputFilter):
+    title = "question id"
+    parameter_name = field = "question"
+
+
+class TrackerFilter(InputFilter):
+    title = "tracker id"
+    parameter_name = field = "tracker"
+
+
+class QuizFilter(InputFilter):
+    title = "quiz id"
+    parameter_name = field = "quiz"
+
+
+class QuizQuestionInline(admin.TabularInline):
+    model = QuizQuestion
+    fields = ["position", "question"]
+    raw_id_fields = ["question"]
+    extra = 1
 
 
 class QuizAdmin(admin.ModelAdmin):
@@ -8,7 +98,9 @@ class QuizAdmin(admin.ModelAdmin):
         "id", "description", "active",
         "created_at", "updated_at", "created_by", "updated_by"]
     list_filter = ["active", "created_at"]
+    list_select_related = ["created_by", "updated_by"]
     search_fields = ["description"]
+    inlines = [QuizQuestionInline]
 
 
 class QuestionAdmin(admin.ModelAdmin):
@@ -17,7 +109,9 @@ class QuestionAdmin(admin.ModelAdmin):
         "response_correct", "response_incorrect", "active",
         "created_at", "updated_at", "created_by", "updated_by"]
     list_filter = ["active", "question_type", "created_at"]
+    list_select_related = ["created_by", "updated_by"]
     search_fields = ["description", "question", "answers"]
+    readonly_fields = ["version"]
 
 
 class AnswerAdmin(admin.ModelAdmin):
@@ -25,19 +119,39 @@ class AnswerAdmin(admin.ModelAdmin):
         "id", "version", "question", "question_text", "answer_value",
         "answer_text", "answer_correct", "response_sent", "tracker",
         "created_at", "created_by", "updated_at", "updated_by"]
-    list_filter = ["answer_correct", "question", "created_at"]
-    search_fields = ["question_text", "answer_text"]
+    list_filter = ["answer_correct", QuestionFilter, TrackerFilter,
+                   "created_at"]
+    list_select_related = ["question", "question_version", "tracker",
+                           "created_by", "updated_by"]
+    raw_id_fields = ["question", "question_version", "tracker"]
+    search_fields = ["question_version__question_text", "answer_text"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class TrackerAdmin(admin.ModelAdmin):
     list_display = [
         "id", "identity", "quiz", "complete",
         "started_at", "created_by", "completed_at", "updated_by"]
-    list_filter = ["complete", "started_at", "completed_at"]
+    list_filter = ["complete", QuizFilter, "started_at", "completed_at"]
+    list_select_related = ["quiz", "created_by", "updated_by"]
+    raw_id_fields = ["quiz"]
     search_fields = ["identity"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = [
+        "id", "quiz", "status", "rows", "total",
+        "created_at", "completed_at", "created_by"]
+    list_filter = ["status", "created_at"]
+    list_select_related = ["quiz", "created_by"]
+    raw_id_fields = ["quiz"]
 
 
 admin.site.register(Quiz, QuizAdmin)
 admin.site.register(Question, QuestionAdmin)
 admin.site.register(Answer, AnswerAdmin)
 admin.site.register(Tracker, TrackerAdmin)
+admin.site.register(ExportJob, ExportJobAdmin)
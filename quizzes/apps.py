@@ -0,0 +1,37 @@
+from django.apps import AppConfig, apps
+from django.db.models.signals import post_delete, post_save, pre_delete
+
+
+class QuizzesConfig(AppConfig):
+    name = 'quizzes'
+
+    def ready(self):
+        from . import hooks, leaderboards
+        from .models import Answer
+        from rest_hooks.models import Hook
+
+        post_save.connect(leaderboards.answer_saved, sender=Answer,
+                          dispatch_uid='leaderboard_answer_saved')
+        pre_delete.connect(leaderboards.answer_deleted, sender=Answer,
+                           dispatch_uid='leaderboard_answer_deleted')
+
+        # django-rest-hooks listens to saves and deletes of every model
+        # and looks the hooks up in the database each time, its
+        # receivers are swapped for ones on just the models with events
+        # which use the cached hooks
+        post_save.disconnect(dispatch_uid='instance-saved-hook')
+        post_delete.disconnect(dispatch_uid='instance-deleted-hook')
+        for model, action in hooks.model_events():
+            sender = apps.get_model(model)
+            if action == 'deleted':
+                post_delete.connect(
+                    hooks.model_deleted, sender=sender,
+                    dispatch_uid='hook_deleted_%s' % model)
+            else:
+                post_save.connect(
+                    hooks.model_saved, sender=sender,
+                    dispatch_uid='hook_saved_%s' % model)
+        post_save.connect(hooks.hook_changed, sender=Hook,
+                          dispatch_uid='hook_cache_saved')
+        post_delete.connect(hooks.hook_changed, sender=Hook,
+                            dispatch_uid='hook_cache_deleted')
@@ -0,0 +1,87 @@
+import hashlib
+
+from django.conf import settings
+from redis import RedisError
+
+from .utils import get_redis
+
+
+class CircuitBreaker(object):
+
+    """
+    A circuit breaker for calls to `target` whose state lives in Redis, so
+    every worker sees the same circuit.
+
+    The circuit opens after `failures` failures within `window` seconds
+    and stays open, refusing calls, for `reset` seconds. After that a
+    single call is let through as a probe: success closes the circuit,
+    failure opens it again. Defaults are the HOOK_CIRCUIT_* settings. If
+    Redis is unavailable every call is allowed.
+    """
+
+    def __init__(self, target, failures=None, window=None, reset=None):
+        self.key = 'circuit:%s' % hashlib.sha1(
+            target.encode('utf-8')).hexdigest()
+        self.failures = failures or settings.HOOK_CIRCUIT_FAILURES
+        self.window = window or settings.HOOK_CIRCUIT_WINDOW
+        self.reset = reset or settings.HOOK_CIRCUIT_RESET_SECONDS
+
+    def allow(self):
+        """
+        Whether a call may be made now
+        """
+        redis = get_redis()
+        try:
+            pipe = redis.pipeline(transaction=False)
+            pipe.exists(self.key + ':open')
+            pipe.exists(self.key + ':tripped')
+            is_open, tripped = pipe.execute()
+            if is_open:
+                return False
+            if tripped:
+                # Half open, only one caller gets to probe the target
+                return bool(redis.set(
+                    self.key + ':probe', 1, nx=True, ex=self.reset))
+        except RedisError:
+            return True
+        return True
+
+    def retry_after(self):
+        """
+        Seconds until the circuit lets a probe through
+        """
+        try:
+            ttl = get_redis().ttl(self.key + ':open')
+        except RedisError:
+            ttl = None
+        if ttl is None or ttl < 0:
+            return self.reset
+        return ttl
+
+    def success(self):
+        try:
+            get_redis().delete(self.key + ':tripped', self.key + ':probe',
+                               self.key + ':failures')
+        except RedisError:
+            pass
+
+    def failure(self):
+        redis = get_redis()
+        try:
+            if redis.exists(self.key + ':tripped'):
+                # The probe failed
+                failures = self.failures
+            else:
+                pipe = redis.pipeline(transaction=False)
+                pipe.incr(self.key + ':failures')
+                pipe.expire(self.key + ':failures', self.window)
+                failures = pipe.execute()[0]
+            if failures >= self.failures:
+                pipe = redis.pipeline(transaction=False)
+                pipe.set(self.key + ':open', 1, ex=self.reset)
+                # Forgotten after a day without calls, closing the circuit
+                pipe.set(self.key + ':tripped', 1, ex=24 * 60 * 60)
+                pipe.delete(self.key + ':probe', self.key + ':failures')
+                pipe.execute()
+        except RedisError:
+            pass
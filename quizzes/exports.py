@@ -0,0 +1,211 @@
+import csv
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils import six, timezone
+from django.utils.encoding import force_bytes
+from rest_framework import serializers
+
+from .models import Answer, AnswerArchive
+from .renderers import FastJSONEncoder
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+# The columns of a results export and the answer fields they are read from
+COLUMNS = (
+    ("tracker", "tracker_id"),
+    ("quiz", "tracker__quiz_id"),
+    ("identity", "tracker__identity"),
+    ("quiz_started_at", "tracker__started_at"),
+    ("quiz_complete", "tracker__complete"),
+    ("quiz_completed_at", "tracker__completed_at"),
+    ("question_id", "question_id"),
+    ("question_text", "question_version__question_text"),
+    ("answer_text", "answer_text"),
+    ("answer_value", "answer_value"),
+    ("answer_correct", "answer_correct"),
+    ("answer_created_at", "created_at"),
+)
+NAMES = [name for name, _ in COLUMNS]
+DATETIMES = ("quiz_started_at", "quiz_completed_at", "answer_created_at")
+
+
+def export_answers(**window):
+    """
+    The querysets of export rows as tuples of COLUMNS: the answers, and
+    the archived answers when the window starts before the archive cutoff
+    so archived trackers may be in it. The window is any of `quiz`,
+    `started_at__gte` and `started_at__lt`; None values are ignored.
+    """
+    filters = dict(('tracker__%s' % key, value)
+                   for key, value in window.items() if value is not None)
+    models = [Answer]
+    start = window.get('started_at__gte')
+    cutoff = timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    if start is None or start < cutoff:
+        models.append(AnswerArchive)
+    return [model.objects.filter(**filters).order_by().values_list(
+            *[field for _, field in COLUMNS]) for model in models]
+
+
+def count_answers(**window):
+    return sum(answers.count() for answers in export_answers(**window))
+
+
+def export_sql(**window):
+    """
+    The (sql, params) of the export rows, in export order
+    """
+    queries = [answers.query.sql_with_params()
+               for answers in export_answers(**window)]
+    sql = ' UNION ALL '.join('(%s)' % sql for sql, _ in queries)
+    params = sum((tuple(params) for _, params in queries), ())
+    # quiz_started_at, tracker, answer_created_at
+    return '%s ORDER BY 4, 1, 12' % sql, params
+
+
+def export_rows(**window):
+    """
+    The export rows as dicts
+    """
+    return [row for batch in iter_row_batches(10000, **window)
+            for row in batch]
+
+
+def iter_row_batches(batch_size, **window):
+    """
+    Yields the export rows as lists of up to `batch_size` dicts, read from
+    a server-side cursor so a whole export is one query and only a batch
+    is held in memory.
+    """
+    sql, params = export_sql(**window)
+    connection = connections[router.db_for_read(Answer)]
+    connection.ensure_connection()
+    # WITH HOLD lets the cursor outlive its transaction, so the caller can
+    # commit progress between batches
+    cursor = connection.connection.cursor(
+        name='export_%s' % uuid.uuid4().hex, withhold=True)
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [dict(zip(NAMES, row)) for row in rows]
+    finally:
+        cursor.close()
+
+
+class CSVWriter(object):
+    """
+    Writes the same CSV as the CSV renderer, header columns sorted
+    """
+    extension = 'csv'
+    content_type = 'text/csv'
+    header = sorted(NAMES)
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.started = False
+
+    def write(self, rows):
+        buf = six.StringIO()
+        writer = csv.writer(buf)
+        if not self.started:
+            writer.writerow(self.header)
+            self.started = True
+        for row in rows:
+            writer.writerow([
+                row[key].encode('utf-8')
+                if isinstance(row[key], six.text_type) and six.PY2
+                else row[key]
+                for key in self.header])
+        self.fileobj.write(force_bytes(buf.getvalue()))
+
+    def close(self):
+        pass
+
+
+class NDJSONWriter(object):
+    """
+    Writes a JSON object per line, with values formatted as the API's
+    serializers format them
+    """
+    extension = 'ndjson'
+    content_type = 'application/x-ndjson'
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.datetime = serializers.DateTimeField().to_representation
+
+    def write(self, rows):
+        # An encoder per batch, as its UUID memo would otherwise grow with
+        # every tracker in the export
+        encoder = FastJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+        lines = []
+        for row in rows:
+            for name in DATETIMES:
+                if row[name] is not None:
+                    row[name] = self.datetime(row[name])
+            lines.append(encoder.encode(row) + '\n')
+        self.fileobj.write(force_bytes(''.join(lines)))
+
+    def close(self):
+        pass
+
+
+class ParquetWriter(object):
+    """
+    Writes a Parquet file with a row group per batch. UUIDs are strings
+    and timestamps UTC microseconds, so they load into pandas typed.
+    """
+    extension = 'parquet'
+    content_type = 'application/octet-stream'
+
+    def __init__(self, fileobj):
+        self.schema = pyarrow.schema([
+            ("tracker", pyarrow.string()),
+            ("quiz", pyarrow.string()),
+            ("identity", pyarrow.string()),
+            ("quiz_started_at", pyarrow.timestamp('us', tz='UTC')),
+            ("quiz_complete", pyarrow.bool_()),
+            ("quiz_completed_at", pyarrow.timestamp('us', tz='UTC')),
+            ("question_id", pyarrow.string()),
+            ("question_text", pyarrow.string()),
+            ("answer_text", pyarrow.string()),
+            ("answer_value", pyarrow.string()),
+            ("answer_correct", pyarrow.bool_()),
+            ("answer_created_at", pyarrow.timestamp('us', tz='UTC')),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(fileobj, self.schema)
+
+    def convert(self, value, type):
+        if value is None:
+            return None
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        if pyarrow.types.is_timestamp(type):
+            return timezone.make_naive(value, timezone.utc)
+        return value
+
+    def write(self, rows):
+        self.writer.write_table(pyarrow.Table.from_arrays([
+            pyarrow.array([self.convert(row[field.name], field.type)
+                           for row in rows], type=field.type)
+            for field in self.schema], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {
+    'csv': CSVWriter,
+    'ndjson': NDJSONWriter,
+    'parquet': ParquetWriter,
+}
@@ -0,0 +1,61 @@
+import json
+
+from rest_framework import filters, serializers
+
+
+class JSONFieldFilterBackend(filters.BaseFilterBackend):
+
+    """
+    Filters the JSONFields named in a view's `json_filter_fields` by
+    containment, so the queries can use the fields' jsonb_path_ops GIN
+    indexes.
+
+    ?metadata__contains={"campaign": "x"}   contains the JSON document
+    ?metadata__campaign__lang=en            has "en" at campaign -> lang
+
+    Key path values are decoded as JSON where they parse, so
+    ?metadata__b=2 matches {"b": 2} and ?metadata__b="2" matches
+    {"b": "2"}. All the filters on a field are combined into a single
+    containment check.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        for field in getattr(view, 'json_filter_fields', ()):
+            document = {}
+            prefix = '%s__' % field
+            for param, value in request.query_params.items():
+                if not param.startswith(prefix):
+                    continue
+                path = param[len(prefix):].split('__')
+                if path == ['contains']:
+                    value = self.decode(param, value, strict=True)
+                    if not isinstance(value, dict):
+                        raise serializers.ValidationError({
+                            param: ["Must be a JSON object."]})
+                    self.merge(document, value)
+                else:
+                    value = self.decode(param, value)
+                    for key in reversed(path):
+                        value = {key: value}
+                    self.merge(document, value)
+            if document:
+                queryset = queryset.filter(
+                    **{'%s__contains' % field: document})
+        return queryset
+
+    def decode(self, param, value, strict=False):
+        try:
+            return json.loads(value)
+        except ValueError:
+            if strict:
+                raise serializers.ValidationError({
+                    param: ["Invalid JSON."]})
+            return value
+
+    def merge(self, document, other):
+        for key, value in other.items():
+            if isinstance(value, dict) and isinstance(
+                    document.get(key), dict):
+                self.merge(document[key], value)
+            else:
+                document[key] = value
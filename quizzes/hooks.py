@@ -0,0 +1,122 @@
+"""
+Fires REST hooks for model events from an in-process map of events to
+their subscribed hooks, instead of django-rest-hooks querying the Hook
+table on every save.
+
+The map is reloaded when a hook changes: saving or deleting a Hook bumps
+a generation counter in Redis once the change commits, which every
+process compares with its map's at most every
+settings.HOOK_CACHE_SECONDS. Only models with hook
+events get the save and delete receivers at all (see apps.py).
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from redis import RedisError
+from rest_hooks.models import Hook
+
+from .utils import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'hooks:generation'
+
+_cache = {
+    'hooks': None,
+    'generation': None,
+    'checked_at': 0,
+}
+
+
+def model_events():
+    """
+    Maps (app_label.ObjectName, action) to the event names in
+    settings.HOOK_EVENTS, and whether they go to every subscriber rather
+    than those of the instance's user
+    """
+    events = {}
+    for event, auto in settings.HOOK_EVENTS.items():
+        if auto:
+            model, action = auto.rsplit('.', 1)
+            action, _, everyone = action.partition('+')
+            events[(model, action)] = (event, bool(everyone))
+    return events
+
+
+def generation():
+    """
+    The current generation, 0 until a hook first changes, or None if it
+    can't be read
+    """
+    try:
+        return int(get_redis().get(GENERATION_KEY) or 0)
+    except RedisError:
+        logger.exception("Hook cache generation unavailable")
+        return None
+
+
+def hook_changed(**kwargs):
+    """
+    Invalidates the hooks once the change to a Hook commits, so no
+    process reloads them before it can see the change. Connected to Hook
+    saves and deletes.
+    """
+    transaction.on_commit(invalidate)
+
+
+def invalidate():
+    """
+    Makes every process reload its hooks
+    """
+    _cache['checked_at'] = 0
+    _cache['hooks'] = None
+    try:
+        get_redis().incr(GENERATION_KEY)
+    except RedisError:
+        logger.exception("Hook cache generation unavailable")
+
+
+def hooks_for_event(event):
+    """
+    The hooks subscribed to `event`, as unsaved Hook instances
+    """
+    now = time.time()
+    if now - _cache['checked_at'] >= settings.HOOK_CACHE_SECONDS:
+        current = generation()
+        if _cache['hooks'] is None or current is None or \
+                current != _cache['generation']:
+            hooks = {}
+            for row in Hook.objects.values('id', 'event', 'target',
+                                           'user_id'):
+                hooks.setdefault(row['event'], []).append(Hook(**row))
+            _cache['hooks'] = hooks
+            _cache['generation'] = current
+        _cache['checked_at'] = now
+    return _cache['hooks'].get(event, ())
+
+
+def fire(instance, action):
+    opts = instance._meta.concrete_model._meta
+    model = '%s.%s' % (opts.app_label, opts.object_name)
+    event = model_events().get((model, action))
+    if event is None:
+        return
+    event, everyone = event
+    hooks = hooks_for_event(event)
+    if hooks and not everyone:
+        user_id = instance.user.pk if instance.user is not None else None
+        hooks = [hook for hook in hooks if hook.user_id == user_id]
+    for hook in hooks:
+        hook.deliver_hook(instance)
+
+
+def model_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        fire(instance, 'created' if created else 'updated')
+
+
+def model_deleted(sender, instance, **kwargs):
+    fire(instance, 'deleted')
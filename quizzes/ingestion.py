@@ -0,0 +1,224 @@
+"""
+Queued answer ingestion, for peaks of answers the database can't take
+one INSERT at a time.
+
+With settings.ANSWER_INGESTION set to 'queued' the answer endpoint only
+validates an answer's fields and pushes it onto a Redis list, refusing
+answers with a 503 once settings.ANSWER_QUEUE_MAX_LENGTH are waiting.
+The IngestAnswers task drains the list in batches, checking each batch's
+questions and trackers in one query apiece and writing its answers with
+a single bulk_create. bulk_create sends no signals, so the leaderboards
+and hooks that answer saves update are updated by the batch instead.
+
+One drain runs at a time. A batch stays on the list until its answers
+are committed, and answers already written are skipped, so a drain that
+dies part way is picked up by the next without losing or repeating
+answers. A drain whose lock lapsed during a batch stops without trimming
+it, leaving the batch to the drain that took the lock over. A batch that
+fails settings.ANSWER_INGEST_MAX_FAILURES times in a row is written an
+answer at a time instead, and the answers that still fail are moved to
+the dead letter list at DEAD_KEY, so one bad answer can't hold up the
+rest. They can be pushed back onto QUEUE_KEY once fixed.
+"""
+import json
+import logging
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F
+from redis import WatchError
+
+from . import hooks, leaderboards
+from .metrics import ANSWER_INGEST_LAG, ANSWER_QUEUE_LENGTH, ANSWERS_INGESTED
+from .models import Answer, QuestionVersion, Tracker
+from .utils import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'answers:queue'
+LOCK_KEY = 'answers:draining'
+PENDING_KEY = 'answers:drain-pending'
+FAILURES_KEY = 'answers:failures'
+DEAD_KEY = 'answers:dead'
+
+# Copied from a queued answer onto the Answer as they are
+FIELDS = ('version', 'answer_value', 'answer_text', 'answer_correct',
+          'response_sent')
+
+
+class QueueFull(Exception):
+    pass
+
+
+def enqueue(data, user):
+    """
+    Queues the validated fields of an answer by `user`, returning the id
+    the answer will be written with
+    """
+    redis = get_redis()
+    if redis.llen(QUEUE_KEY) >= settings.ANSWER_QUEUE_MAX_LENGTH:
+        ANSWERS_INGESTED.labels('rejected').inc()
+        raise QueueFull
+    item = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+    item.update(id=str(uuid.uuid4()), created_by=user.pk,
+                enqueued_at=time.time())
+    ANSWER_QUEUE_LENGTH.set(redis.lpush(QUEUE_KEY, json.dumps(item)))
+    ANSWERS_INGESTED.labels('queued').inc()
+    return item['id']
+
+
+def request_drain():
+    """
+    Whether the caller should start a drain, true for one caller until
+    the next drain starts
+    """
+    return bool(get_redis().set(PENDING_KEY, 1, nx=True,
+                                ex=settings.ANSWER_INGEST_LOCK_SECONDS))
+
+
+def queued():
+    return get_redis().llen(QUEUE_KEY)
+
+
+def drain(batch_size):
+    """
+    Writes queued answers, oldest first, `batch_size` at a time until the
+    queue is empty. Returns the number of answers taken off the queue, or
+    None if another drain is running.
+    """
+    redis = get_redis()
+    redis.delete(PENDING_KEY)
+    token = uuid.uuid4().hex
+    if not redis.set(LOCK_KEY, token, nx=True,
+                     ex=settings.ANSWER_INGEST_LOCK_SECONDS):
+        return None
+    drained = 0
+    try:
+        while True:
+            # Answers are pushed onto the head, so the oldest are the tail
+            raw = redis.lrange(QUEUE_KEY, -batch_size, -1)
+            if not raw:
+                break
+            raw.reverse()
+            try:
+                ingest([json.loads(item.decode('utf-8')) for item in raw])
+            except Exception:
+                if redis.incr(FAILURES_KEY) < \
+                        settings.ANSWER_INGEST_MAX_FAILURES:
+                    raise
+                logger.exception("Answer batch failed %s times, writing "
+                                 "its answers one at a time" %
+                                 settings.ANSWER_INGEST_MAX_FAILURES)
+                ingest_each(raw)
+            if not trim(redis, token, len(raw)):
+                logger.warning("Answer drain lost its lock, stopping")
+                break
+            drained += len(raw)
+    finally:
+        with redis.pipeline() as pipe:
+            try:
+                pipe.watch(LOCK_KEY)
+                if pipe.get(LOCK_KEY) == token.encode('utf-8'):
+                    pipe.multi()
+                    pipe.delete(LOCK_KEY)
+                    pipe.execute()
+            except WatchError:
+                pass
+        ANSWER_QUEUE_LENGTH.set(redis.llen(QUEUE_KEY))
+    return drained
+
+
+def trim(redis, token, count):
+    """
+    Takes the `count` oldest answers, a batch just written, off the queue
+    and extends the drain's lock, if the drain still holds the lock with
+    `token`. Returns whether it did.
+    """
+    with redis.pipeline() as pipe:
+        try:
+            # Nothing is trimmed if the lock changes hands in between
+            pipe.watch(LOCK_KEY)
+            if pipe.get(LOCK_KEY) != token.encode('utf-8'):
+                return False
+            pipe.multi()
+            pipe.ltrim(QUEUE_KEY, 0, -count - 1)
+            pipe.delete(FAILURES_KEY)
+            pipe.expire(LOCK_KEY, settings.ANSWER_INGEST_LOCK_SECONDS)
+            pipe.execute()
+        except WatchError:
+            return False
+    return True
+
+
+def ingest_each(raw):
+    """
+    Writes queued answers one at a time, moving those that fail to the
+    dead letter list
+    """
+    for item in raw:
+        try:
+            ingest([json.loads(item.decode('utf-8'))])
+        except Exception:
+            logger.exception("Moved queued answer to %s: %r" % (
+                DEAD_KEY, item))
+            get_redis().lpush(DEAD_KEY, item)
+            ANSWERS_INGESTED.labels('dead').inc()
+
+
+def ingest(items):
+    """
+    Writes a batch of queued answers. Answers whose question or tracker
+    doesn't exist are dropped, and those already written skipped.
+    """
+    written = set(str(pk) for pk in Answer.objects.filter(
+        id__in=[item['id'] for item in items]).values_list('id', flat=True))
+    versions = dict(
+        (str(question), version) for question, version in
+        QuestionVersion.objects.filter(
+            question_id__in=set(item['question_id'] for item in items),
+            version=F('question__version')).values_list(
+            'question_id', 'id'))
+    trackers = dict(
+        (str(tracker), (quiz, identity)) for tracker, quiz, identity in
+        Tracker.objects.filter(
+            id__in=set(item['tracker_id'] for item in items)).values_list(
+            'id', 'quiz_id', 'identity'))
+    users = User.objects.in_bulk(set(item['created_by'] for item in items))
+
+    answers = []
+    for item in items:
+        if item['id'] in written:
+            ANSWERS_INGESTED.labels('duplicate').inc()
+            continue
+        version = versions.get(item['question_id'])
+        if version is None or item['tracker_id'] not in trackers:
+            logger.warning("Dropped queued answer %s, its question or "
+                           "tracker doesn't exist" % item['id'])
+            ANSWERS_INGESTED.labels('invalid').inc()
+            continue
+        user = users.get(item['created_by'])
+        answers.append(Answer(
+            id=item['id'], question_id=item['question_id'],
+            question_version_id=version, tracker_id=item['tracker_id'],
+            created_by=user, updated_by=user,
+            **dict((field, item[field]) for field in FIELDS
+                   if field in item)))
+
+    with transaction.atomic():
+        Answer.objects.bulk_create(answers)
+        for answer in answers:
+            hooks.fire(answer, 'created')
+
+    scores = Counter(trackers[answer.tracker_id] for answer in answers
+                     if answer.answer_correct)
+    for (quiz, identity), score in scores.items():
+        leaderboards.record(quiz, identity, score)
+    ANSWERS_INGESTED.labels('created').inc(len(answers))
+    if items:
+        ANSWER_INGEST_LAG.observe(time.time() - items[0]['enqueued_at'])
@@ -0,0 +1,153 @@
+"""
+Per-quiz leaderboards of identities by their number of correct answers,
+across all their attempts, kept in a Redis sorted set per quiz.
+
+Boards are updated as answers are saved and deleted, by `answer_saved`
+and `answer_deleted` connected in apps.py, and rebuilt from the database
+with the rebuild_leaderboards command, which also corrects any drift
+from updates lost while Redis was unavailable.
+"""
+import logging
+import uuid
+
+from django.db import transaction
+from django.db.models import Count
+from redis import RedisError
+
+from .models import Answer, AnswerArchive
+from .utils import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+def leaderboard_key(quiz_id):
+    return 'leaderboard:%s' % quiz_id
+
+
+def record(quiz_id, identity, delta):
+    """
+    Adds `delta` correct answers to the score of `identity` on the quiz
+    """
+    key = leaderboard_key(quiz_id)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.zincrby(key, str(identity), delta)
+        if delta < 0:
+            # Identities without correct answers aren't on the board
+            pipe.zremrangebyscore(key, '-inf', 0)
+        pipe.execute()
+    except RedisError:
+        logger.exception("Leaderboard update lost for quiz %s" % quiz_id)
+
+
+def entry(identity, score, rank):
+    return {
+        "identity": identity,
+        "score": int(score),
+        "rank": rank,
+    }
+
+
+def top(quiz_id, limit):
+    """
+    The `limit` highest scoring identities on the quiz. Ties share a
+    rank, the next rank counting every identity ahead of it.
+    """
+    rows = get_redis().zrevrange(
+        leaderboard_key(quiz_id), 0, limit - 1, withscores=True)
+    entries = []
+    for position, (identity, score) in enumerate(rows, 1):
+        if entries and score == entries[-1]["score"]:
+            rank = entries[-1]["rank"]
+        else:
+            rank = position
+        entries.append(entry(identity.decode('utf-8'), score, rank))
+    return entries
+
+
+def rank(quiz_id, identity):
+    """
+    The score and rank of `identity` on the quiz, None if it has no
+    correct answers on it
+    """
+    redis = get_redis()
+    key = leaderboard_key(quiz_id)
+    score = redis.zscore(key, str(identity))
+    if score is None:
+        return None
+    ahead = redis.zcount(key, '(%s' % score, '+inf')
+    return entry(str(identity), score, ahead + 1)
+
+
+def rebuild(quiz_ids=None, batch_size=10000):
+    """
+    Rebuilds the boards of `quiz_ids`, or of every quiz, from the answers
+    and archived answers in the database. Each board is built under a
+    temporary key and renamed into place, so readers never see a partial
+    board. Returns the number of boards rebuilt.
+    """
+    redis = get_redis()
+    scores = {}
+    for model in (Answer, AnswerArchive):
+        answers = model.objects.filter(answer_correct=True)
+        if quiz_ids is not None:
+            answers = answers.filter(tracker__quiz__in=quiz_ids)
+        rows = answers.values_list(
+            'tracker__quiz', 'tracker__identity').annotate(
+            score=Count('id')).order_by()
+        for quiz_id, identity, score in rows.iterator():
+            board = scores.setdefault(str(quiz_id), {})
+            board[str(identity)] = board.get(str(identity), 0) + score
+
+    if quiz_ids is None:
+        # Boards of quizzes without correct answers any more go too
+        quiz_ids = set(scores)
+        for key in redis.scan_iter(leaderboard_key('*')):
+            parts = key.decode('utf-8').split(':')
+            if len(parts) == 2:
+                quiz_ids.add(parts[1])
+    for quiz_id in quiz_ids:
+        board = list(scores.get(str(quiz_id), {}).items())
+        if not board:
+            redis.delete(leaderboard_key(quiz_id))
+            continue
+        building = '%s:%s' % (leaderboard_key(quiz_id), uuid.uuid4().hex)
+        for start in range(0, len(board), batch_size):
+            redis.zadd(building, **dict(board[start:start + batch_size]))
+        redis.rename(building, leaderboard_key(quiz_id))
+    return len(quiz_ids)
+
+
+def answer_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    Counts a new correct answer, or a change to whether one is correct
+    """
+    if raw:
+        return
+    before = False if created else getattr(instance, '_loaded_correct', None)
+    if before is None or before == instance.answer_correct:
+        return
+    tracker = instance.tracker
+    record_on_commit(tracker.quiz_id, tracker.identity,
+                     1 if instance.answer_correct else -1)
+    instance._loaded_correct = instance.answer_correct
+
+
+def answer_deleted(sender, instance, **kwargs):
+    """
+    Takes a deleted correct answer off, looking the tracker up before the
+    delete so it can still be found when it is being deleted with its
+    answers
+    """
+    if instance.answer_correct:
+        tracker = instance.tracker
+        record_on_commit(tracker.quiz_id, tracker.identity, -1)
+
+
+def record_on_commit(quiz_id, identity, delta):
+    """
+    Records the change once the transaction making it commits, so rolled
+    back answers never count
+    """
+    transaction.on_commit(lambda: record(quiz_id, identity, delta))
@@ -0,0 +1,171 @@
+import json
+import random
+from datetime import timedelta
+from timeit import default_timer as timer
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from quizzes.models import Quiz, Tracker
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+
+class Command(BaseCommand):
+    help = ("Times the key API endpoints in-process against the current "
+            "database, reporting latency percentiles, query counts and "
+            "response sizes. Seed data first with seed_benchmark_data. "
+            "Write results with --output and compare a later run against "
+            "them with --baseline. Set --accept-encoding to measure "
+            "compressed responses and --link-kbps to add the time they "
+            "take to transfer over a link of that speed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--only', nargs='+', metavar='SCENARIO',
+                            help="Run only these scenarios")
+        parser.add_argument('--export-days', type=int, default=1,
+                            help="Days of trackers the export scenario "
+                                 "pulls")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--accept-encoding', default='',
+                            help="Accept-Encoding header to send, e.g. "
+                                 "gzip or br")
+        parser.add_argument('--link-kbps', type=float, default=None,
+                            help="Add the transfer time of each response "
+                                 "over a link of this many kbit/s")
+        parser.add_argument('--output',
+                            help="Write the results as JSON to this file")
+        parser.add_argument('--baseline',
+                            help="Compare against results previously "
+                                 "written with --output")
+
+    def handle(self, *args, **options):
+        rand = random.Random(options['seed'])
+        trackers = list(Tracker.objects.order_by('?').values(
+            'id', 'identity', 'quiz')[:200])
+        quizzes = list(Quiz.objects.values_list('id', flat=True)[:200])
+        if not trackers or not quizzes:
+            raise CommandError("No data, run seed_benchmark_data first.")
+        questions = dict(
+            (quiz.id, [q.id for q in quiz.questions.all()])
+            for quiz in Quiz.objects.filter(
+                id__in=set(t['quiz'] for t in trackers)).prefetch_related(
+                'questions'))
+        trackers = [t for t in trackers if questions.get(t['quiz'])]
+
+        user, _ = User.objects.get_or_create(username='benchmark')
+        token, _ = Token.objects.get_or_create(user=user)
+        client = Client(HTTP_AUTHORIZATION='Token %s' % token.key,
+                        HTTP_ACCEPT_ENCODING=options['accept_encoding'])
+        since = (timezone.now() - timedelta(
+            days=options['export_days'])).isoformat()
+
+        def create_answer():
+            tracker = rand.choice(trackers)
+            return client.post('/api/v1/answer/', json.dumps({
+                "question": str(rand.choice(questions[tracker['quiz']])),
+                "answer_value": "correct",
+                "answer_text": "Correct",
+                "answer_correct": True,
+                "response_sent": "Well done!",
+                "tracker": str(tracker['id'])
+            }), content_type='application/json')
+
+        scenarios = [
+            ('quiz-list', lambda: client.get('/api/v1/quiz/')),
+            ('quiz-retrieve', lambda: client.get(
+                '/api/v1/quiz/%s/' % rand.choice(quizzes))),
+            ('question-list', lambda: client.get('/api/v1/question/')),
+            ('tracker-list', lambda: client.get('/api/v1/tracker/')),
+            ('tracker-retrieve', lambda: client.get(
+                '/api/v1/tracker/%s/' % rand.choice(trackers)['id'])),
+            ('answer-list', lambda: client.get('/api/v1/answer/')),
+            ('answer-create', create_answer),
+            ('quiz-untaken', lambda: client.get(
+                '/api/v1/quiz/untaken',
+                {'identity': str(rand.choice(trackers)['identity'])})),
+            ('stats', lambda: client.get('/api/v1/stats')),
+            ('export', lambda: client.get(
+                '/api/v1/tracker/export', {'started_at__gte': since})),
+        ]
+        if options['only']:
+            unknown = set(options['only']) - set(s[0] for s in scenarios)
+            if unknown:
+                raise CommandError("Unknown scenarios: %s" % ', '.join(
+                    sorted(unknown)))
+            scenarios = [s for s in scenarios if s[0] in options['only']]
+
+        results = {}
+        for name, request in scenarios:
+            results[name] = self.run_scenario(
+                request, options['iterations'], options['link_kbps'])
+
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        self.report(scenarios, results, baseline)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+    def run_scenario(self, request, iterations, link_kbps=None):
+        timings, queries, sizes, errors = [], [], [], 0
+        # One untimed request to warm caches and connections
+        for iteration in range(iterations + 1):
+            # Writes are rolled back so runs are repeatable
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as captured:
+                    start = timer()
+                    response = request()
+                    if response.streaming:
+                        content = b''.join(response.streaming_content)
+                    else:
+                        content = response.content
+                    elapsed = timer() - start
+                transaction.set_rollback(True)
+            if not iteration:
+                continue
+            if response.status_code >= 400:
+                errors += 1
+            if link_kbps:
+                elapsed += len(content) * 8 / (link_kbps * 1000)
+            timings.append(elapsed * 1000)
+            queries.append(len(captured))
+            sizes.append(len(content))
+        return {
+            'requests': iterations,
+            'errors': errors,
+            'p50_ms': percentile(timings, 50),
+            'p90_ms': percentile(timings, 90),
+            'p99_ms': percentile(timings, 99),
+            'max_ms': max(timings),
+            'queries': sum(queries) / float(len(queries)),
+            'bytes': sum(sizes) / float(len(sizes)),
+        }
+
+    def report(self, scenarios, results, baseline):
+        row = '%-17s %6s %9s %9s %9s %9s %8s %10s %8s'
+        self.stdout.write(row % (
+            'scenario', 'errors', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms',
+            'queries', 'bytes', 'vs p50'))
+        for name, _ in scenarios:
+            result = results[name]
+            change = ''
+            if name in baseline and baseline[name]['p50_ms']:
+                change = '%+.0f%%' % (
+                    (result['p50_ms'] / baseline[name]['p50_ms'] - 1) * 100)
+            self.stdout.write(row % (
+                name, result['errors'], '%.1f' % result['p50_ms'],
+                '%.1f' % result['p90_ms'], '%.1f' % result['p99_ms'],
+                '%.1f' % result['max_ms'], '%.1f' % result['queries'],
+                '%.0f' % result['bytes'], change))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from quizzes import leaderboards
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds the quiz leaderboards in Redis from the answers in "
+            "the database, for every quiz or those given with --quiz. "
+            "Run after restoring Redis or to correct drift from updates "
+            "lost while it was unavailable.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quiz', nargs='+', metavar='QUIZ_ID',
+                            help="Rebuild only these quizzes' boards")
+
+    def handle(self, *args, **options):
+        rebuilt = leaderboards.rebuild(options['quiz'])
+        self.stdout.write("Rebuilt %s leaderboards" % rebuilt)
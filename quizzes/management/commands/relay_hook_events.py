@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from quizzes.tasks import RelayHookEvents
+
+
+class Command(BaseCommand):
+    help = ("Relays webhook deliveries from the outbox to Celery until "
+            "stopped, polling every --interval seconds while the outbox "
+            "is empty. Several relays can run at once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0.5)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--once', action='store_true',
+                            help="Empty the outbox once and exit")
+
+    def handle(self, *args, **options):
+        relay = RelayHookEvents()
+        while True:
+            relayed = relay.run(batch_size=options['batch_size'])
+            if options['once']:
+                self.stdout.write("Relayed %s hook events" % relayed)
+                return
+            if not relayed:
+                time.sleep(options['interval'])
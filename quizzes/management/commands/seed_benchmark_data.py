@@ -0,0 +1,155 @@
+import json
+import random
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import six, timezone
+
+from quizzes.models import (Quiz, Question, QuestionVersion, Tracker,
+                            Answer)
+
+
+def copy_rows(model, columns, rows):
+    """
+    Loads rows into the table of `model` with COPY, which is far faster
+    than INSERTs at the volumes this command generates.
+    """
+    buf = six.StringIO()
+    for row in rows:
+        buf.write('\t'.join(
+            '\\N' if value is None else six.text_type(value)
+            for value in row))
+        buf.write('\n')
+    buf.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert('COPY %s (%s) FROM STDIN' % (
+            model._meta.db_table, ', '.join(columns)), buf)
+
+
+class Command(BaseCommand):
+    help = ("Seeds the database with realistic volumes of synthetic "
+            "quizzes, trackers and answers for benchmarking. Identities "
+            "and quizzes are drawn from a skewed distribution so a few "
+            "learners and quizzes account for most of the activity.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quizzes', type=int, default=2000)
+        parser.add_argument('--questions-per-quiz', type=int, default=5)
+        parser.add_argument('--identities', type=int, default=200000)
+        parser.add_argument('--trackers', type=int, default=1000000)
+        parser.add_argument('--days', type=int, default=365,
+                            help="Spread trackers over this many days")
+        parser.add_argument('--skew', type=float, default=3.0,
+                            help="Higher values concentrate activity on "
+                                 "fewer identities and quizzes")
+        parser.add_argument('--batch-size', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=None,
+                            help="Random seed, for repeatable datasets")
+
+    def handle(self, *args, **options):
+        rand = random.Random(options['seed'])
+        skew = options['skew']
+
+        def skewed(population):
+            return population[int(len(population) * rand.random() ** skew)]
+
+        with transaction.atomic():
+            quizzes = self.create_quizzes(rand, options)
+        identities = [uuid.UUID(int=rand.getrandbits(128), version=4)
+                      for _ in range(options['identities'])]
+        now = timezone.now()
+        active = set()
+        total_answers = 0
+        remaining = options['trackers']
+        while remaining > 0:
+            batch = min(remaining, options['batch_size'])
+            trackers, answers = [], []
+            for _ in range(batch):
+                quiz, questions = skewed(quizzes)
+                identity = skewed(identities)
+                started_at = now - timedelta(
+                    seconds=rand.randint(0, options['days'] * 86400))
+                complete = rand.random() < 0.7
+                if not complete:
+                    if (identity, quiz) in active:
+                        complete = True
+                    else:
+                        active.add((identity, quiz))
+                answered = questions if complete else questions[
+                    :rand.randint(0, len(questions))]
+                tracker_id = uuid.uuid4()
+                answered_at = started_at
+                for question_id, version_id in answered:
+                    answered_at += timedelta(seconds=rand.randint(5, 600))
+                    correct = rand.random() < 0.6
+                    answers.append((
+                        uuid.uuid4(), 1, question_id, version_id,
+                        'correct' if correct else 'wrong',
+                        'Correct' if correct else 'Wrong',
+                        't' if correct else 'f',
+                        'Well done!' if correct else 'Try again!',
+                        answered_at.isoformat(), answered_at.isoformat(),
+                        tracker_id))
+                trackers.append((
+                    tracker_id, identity, quiz, 't' if complete else 'f', 'f',
+                    json.dumps({"channel": rand.choice(["sms", "ussd"])}),
+                    started_at.isoformat(),
+                    answered_at.isoformat() if complete else None))
+            with transaction.atomic():
+                copy_rows(Tracker, (
+                    'id', 'identity', 'quiz_id', 'complete', 'abandoned',
+                    'metadata', 'started_at', 'completed_at'), trackers)
+                copy_rows(Answer, (
+                    'id', 'version', 'question_id', 'question_version_id',
+                    'answer_value', 'answer_text', 'answer_correct',
+                    'response_sent', 'created_at', 'updated_at',
+                    'tracker_id'), answers)
+            remaining -= batch
+            total_answers += len(answers)
+            self.stdout.write("Created %s trackers, %s answers" % (
+                options['trackers'] - remaining, total_answers))
+
+        with connection.cursor() as cursor:
+            for model in (Quiz, Question, QuestionVersion, Tracker, Answer):
+                cursor.execute('ANALYZE %s' % model._meta.db_table)
+        self.stdout.write("Done")
+
+    def create_quizzes(self, rand, options):
+        """
+        Returns a list of (quiz id, [(question id, version id), ...])
+        """
+        quizzes = []
+        through = Quiz.questions.through
+        for number in range(options['quizzes']):
+            quiz = Quiz(description="Benchmark quiz %s" % number,
+                        active=rand.random() < 0.8,
+                        metadata={"campaign": rand.choice(["a", "b", "c"]),
+                                  "lang": rand.choice(["en", "zu", "xh"])})
+            questions = [
+                Question(question_type="multiplechoice",
+                         question="Question %s of quiz %s" % (n, number),
+                         answers=[{"value": "correct", "text": "Correct",
+                                   "correct": True},
+                                  {"value": "wrong", "text": "Wrong",
+                                   "correct": False}],
+                         response_correct="Well done!",
+                         response_incorrect="Try again!", active=True)
+                for n in range(options['questions_per_quiz'])]
+            quizzes.append((quiz, questions))
+        Quiz.objects.bulk_create([quiz for quiz, _ in quizzes])
+        Question.objects.bulk_create(
+            [q for _, questions in quizzes for q in questions])
+        versions = dict(
+            (q.id, QuestionVersion(question=q, version=q.version,
+                                   **q.snapshot()))
+            for _, questions in quizzes for q in questions)
+        QuestionVersion.objects.bulk_create(versions.values())
+        through.objects.bulk_create([
+            through(quiz_id=quiz.id, question_id=q.id, position=position)
+            for quiz, questions in quizzes
+            for position, q in enumerate(questions, 1)])
+        self.stdout.write("Created %s quizzes" % len(quizzes))
+        return [(quiz.id, [(q.id, versions[q.id].id) for q in questions])
+                for quiz, questions in quizzes]
@@ -0,0 +1,127 @@
+"""
+Prometheus metrics, exposed in the text format on /metrics.
+
+When running several worker processes (gunicorn, celery) point the
+prometheus_multiproc_dir environment variable at a shared, empty
+directory so /metrics aggregates across them.
+"""
+import os
+from timeit import default_timer as timer
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               CONTENT_TYPE_LATEST, REGISTRY, generate_latest)
+from prometheus_client import multiprocess
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route',
+    ['route', 'method', 'status'])
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries made per request',
+    ['route'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500, float('inf')))
+REQUEST_QUERY_TIME = Histogram(
+    'http_request_db_query_duration_seconds',
+    'Time spent in database queries per request', ['route'])
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups by cache and result',
+    ['cache', 'result'])
+HOOK_DELIVERIES = Histogram(
+    'hook_delivery_duration_seconds', 'Webhook delivery latency by outcome',
+    ['outcome'])
+ANSWER_QUEUE_LENGTH = Gauge(
+    'answer_queue_length', 'Answers waiting in the ingestion queue',
+    multiprocess_mode='liveall')
+ANSWERS_INGESTED = Counter(
+    'answers_ingested_total', 'Queued answers by outcome', ['outcome'])
+ANSWER_INGEST_LAG = Histogram(
+    'answer_ingest_lag_seconds',
+    'Time the oldest answer of each ingested batch spent queued',
+    buckets=(.1, .5, 1, 2.5, 5, 10, 30, 60, 300, float('inf')))
+
+
+class CountingMixin(object):
+
+    """
+    Counts and times the queries run through a connection, far more
+    cheaply than the debug cursor which keeps the SQL of every query.
+    """
+
+    def execute(self, sql, params=None):
+        start = timer()
+        try:
+            return super(CountingMixin, self).execute(sql, params)
+        finally:
+            self.db.query_count += 1
+            self.db.query_time += timer() - start
+
+    def executemany(self, sql, param_list):
+        start = timer()
+        try:
+            return super(CountingMixin, self).executemany(sql, param_list)
+        finally:
+            self.db.query_count += 1
+            self.db.query_time += timer() - start
+
+
+class CountingCursorWrapper(CountingMixin, CursorWrapper):
+    pass
+
+
+class CountingDebugCursorWrapper(CountingMixin, CursorDebugWrapper):
+    # Connections logging queries, with DEBUG on or in tests capturing
+    # them, use the debug cursor instead
+    pass
+
+
+def reset_query_counters():
+    """
+    Starts counting queries from zero on this thread's connections
+    """
+    for connection in connections.all():
+        if not hasattr(connection, 'query_count'):
+            connection.make_cursor = (
+                lambda cursor, db=connection:
+                    CountingCursorWrapper(cursor, db))
+            connection.make_debug_cursor = (
+                lambda cursor, db=connection:
+                    CountingDebugCursorWrapper(cursor, db))
+        connection.query_count = 0
+        connection.query_time = 0.0
+
+
+def query_counters():
+    """
+    Returns (queries, seconds) counted since reset_query_counters
+    """
+    queries, seconds = 0, 0.0
+    for connection in connections.all():
+        queries += getattr(connection, 'query_count', 0)
+        seconds += getattr(connection, 'query_time', 0.0)
+    return queries, seconds
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def metrics_view(request):
+    """
+    Serves the metrics to requests bearing settings.METRICS_TOKEN, as
+    Prometheus sends with `bearer_token`, and to nobody when it isn't set
+    """
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not constant_time_compare(header, 'Bearer %s' % token):
+        return HttpResponseForbidden()
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry),
+                        content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,211 @@
+import hashlib
+import logging
+import re
+import zlib
+from timeit import default_timer as timer
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+from redis import RedisError
+
+from .metrics import (REQUEST_LATENCY, REQUEST_QUERIES, REQUEST_QUERY_TIME,
+                      reset_query_counters, query_counters)
+from .routers import allow_replicas
+from .utils import get_redis
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware(object):
+
+    """
+    Records per-route request latency and database query counts and time.
+    Routes are labelled by URL name so the label set stays bounded.
+    """
+
+    def process_request(self, request):
+        request._metrics_start = timer()
+        reset_query_counters()
+
+    def process_response(self, request, response):
+        start = getattr(request, '_metrics_start', None)
+        if start is None:
+            return response
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            route = 'unmatched'
+        else:
+            route = match.url_name or match.view_name
+        REQUEST_LATENCY.labels(
+            route, request.method, response.status_code).observe(
+            timer() - start)
+        queries, seconds = query_counters()
+        REQUEST_QUERIES.labels(route).observe(queries)
+        REQUEST_QUERY_TIME.labels(route).observe(seconds)
+        return response
+
+
+def accepted_encodings(header):
+    """
+    Returns the content codings an Accept-Encoding header allows, leaving
+    out any refused with q=0.
+    """
+    encodings = set()
+    for item in header.split(','):
+        params = item.strip().split(';')
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if params[0] and q > 0:
+            encodings.add(params[0].strip().lower())
+    return encodings
+
+
+def compress_sequence_gzip(sequence):
+    # Django's compress_sequence leaves chunks buffered in zlib until it
+    # has a full block, so sync flush each chunk instead
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for item in sequence:
+        data = compressor.compress(item) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_sequence_brotli(sequence, quality):
+    compressor = brotli.Compressor(quality=quality)
+    for item in sequence:
+        # Flush each chunk so streamed exports reach the client as they
+        # are produced
+        data = compressor.process(item) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+
+    """
+    Compresses responses with brotli, when it is installed and the client
+    accepts it, or gzip. Responses shorter than
+    settings.COMPRESSION_MIN_SIZE bytes are sent as they are, since
+    compressing them costs more time than the bytes it saves, as are
+    those of the already compressed `incompressible_types`, Parquet
+    exports among them. Other streaming responses are always compressed,
+    chunk by chunk.
+    """
+    incompressible_types = ('application/octet-stream', 'application/gzip',
+                            'application/zip', 'image/', 'audio/', 'video/')
+
+    def process_response(self, request, response):
+        if (not response.streaming and
+                len(response.content) < settings.COMPRESSION_MIN_SIZE):
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+        if response.get('Content-Type', '').startswith(
+                self.incompressible_types):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encodings = accepted_encodings(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in encodings:
+            encoding = 'br'
+        elif 'gzip' in encodings:
+            encoding = 'gzip'
+        else:
+            return response
+
+        quality = settings.COMPRESSION_BROTLI_QUALITY
+        if response.streaming:
+            if encoding == 'br':
+                response.streaming_content = compress_sequence_brotli(
+                    response.streaming_content, quality)
+            else:
+                response.streaming_content = compress_sequence_gzip(
+                    response.streaming_content)
+            del response['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(response.content,
+                                             quality=quality)
+            else:
+                compressed = compress_string(response.content)
+            # Some content, images for one, doesn't get any smaller
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        if response.has_header('ETag'):
+            response['ETag'] = re.sub('"$', ';%s"' % encoding,
+                                      response['ETag'])
+        response['Content-Encoding'] = encoding
+        return response
+
+
+class ReplicaMiddleware(object):
+
+    """
+    Lets GET, HEAD and OPTIONS requests read from the replicas, see
+    quizzes.routers. A client that has just written is pinned to the
+    primary for settings.REPLICA_PIN_SECONDS, long enough for the
+    replicas to catch up, so it always reads its own writes. Clients are
+    told apart by their credentials or session cookie, the one a write
+    sets when it starts a new session such as logging in. Clients with
+    neither are never pinned, and failed writes don't pin.
+    """
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def get_pin_key(self, request, response=None):
+        """
+        The Redis key pinning the client to the primary, None for clients
+        that can't be told apart
+        """
+        cookie = settings.SESSION_COOKIE_NAME
+        if response is not None and cookie in response.cookies:
+            session = response.cookies[cookie].value
+        else:
+            session = request.COOKIES.get(cookie)
+        client = request.META.get('HTTP_AUTHORIZATION') or session
+        if not client:
+            return None
+        return 'replica-pin:%s' % hashlib.sha1(
+            client.encode('utf-8')).hexdigest()
+
+    def process_request(self, request):
+        allowed = False
+        if settings.REPLICA_DATABASES and \
+                request.method in self.safe_methods:
+            key = self.get_pin_key(request)
+            try:
+                allowed = key is None or not get_redis().exists(key)
+            except RedisError:
+                logger.exception("Replica pins unavailable")
+        allow_replicas(allowed)
+
+    def process_response(self, request, response):
+        allow_replicas(False)
+        if settings.REPLICA_DATABASES and \
+                request.method not in self.safe_methods and \
+                response.status_code < 400:
+            key = self.get_pin_key(request, response)
+            try:
+                if key is not None:
+                    get_redis().set(key, 1, ex=settings.REPLICA_PIN_SECONDS)
+            except RedisError:
+                logger.exception("Replica pins unavailable")
+        return response
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-19 11:14
+from __future__ import unicode_literals
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('quizzes', '0006_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionVersion',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('version', models.IntegerField()),
+                ('question_type', models.CharField(choices=[('multiplechoice', 'Multiple Choice'), ('truefalse', 'True/False'), ('freetext', 'Freeform Input')], max_length=50)),
+                ('question_text', models.CharField(max_length=255)),
+                ('answers', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('response_correct', models.CharField(max_length=200)),
+                ('response_incorrect', models.CharField(max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='quizzes.Question')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='question_version',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='version_answers', to='quizzes.QuestionVersion'),
+        ),
+        migrations.AddField(
+            model_name='answerarchive',
+            name='question_version',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_version_answers', to='quizzes.QuestionVersion'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='questionversion',
+            unique_together=set([('question', 'version')]),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Min
+
+
+def backfill_question_versions(apps, schema_editor):
+    """
+    Snapshot every question at its current version and point existing
+    answers at a snapshot. Answers whose copied question text differs from
+    the current text get a snapshot per historical text, numbered in the
+    order the texts were first answered and ahead of the current version.
+    """
+    Question = apps.get_model('quizzes', 'Question')
+    QuestionVersion = apps.get_model('quizzes', 'QuestionVersion')
+    answer_models = [apps.get_model('quizzes', 'Answer'),
+                     apps.get_model('quizzes', 'AnswerArchive')]
+
+    for question in Question.objects.all().iterator():
+        first_seen = {}
+        for model in answer_models:
+            texts = model.objects.filter(question=question).exclude(
+                question_text=question.question).values(
+                'question_text').annotate(first=Min('created_at'))
+            for row in texts:
+                text = row['question_text']
+                if text not in first_seen or row['first'] < first_seen[text]:
+                    first_seen[text] = row['first']
+        legacy = sorted(first_seen, key=lambda text: first_seen[text])
+
+        versions = {}
+        for number, text in enumerate(legacy, 1):
+            versions[text] = QuestionVersion.objects.create(
+                question=question, version=number,
+                question_type=question.question_type, question_text=text,
+                answers=question.answers,
+                response_correct=question.response_correct,
+                response_incorrect=question.response_incorrect)
+        if question.version <= len(legacy):
+            question.version = len(legacy) + 1
+            Question.objects.filter(id=question.id).update(
+                version=question.version)
+        versions[question.question] = QuestionVersion.objects.create(
+            question=question, version=question.version,
+            question_type=question.question_type,
+            question_text=question.question, answers=question.answers,
+            response_correct=question.response_correct,
+            response_incorrect=question.response_incorrect,
+            created_by=question.updated_by)
+
+        for model in answer_models:
+            for text, version in versions.items():
+                model.objects.filter(
+                    question=question, question_text=text).update(
+                    question_version=version)
+
+
+def restore_question_text(apps, schema_editor):
+    QuestionVersion = apps.get_model('quizzes', 'QuestionVersion')
+    answer_models = [apps.get_model('quizzes', 'Answer'),
+                     apps.get_model('quizzes', 'AnswerArchive')]
+    for version in QuestionVersion.objects.all().iterator():
+        for model in answer_models:
+            model.objects.filter(question_version=version).update(
+                question_text=version.question_text[:200],
+                question_version=None)
+    QuestionVersion.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0007_questionversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_question_versions,
+                             restore_question_text),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-19 11:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0008_backfill_question_versions'),
+    ]
+
+    operations = [
+        # Give the columns a default first so the removal can be reversed
+        # onto existing rows
+        migrations.AlterField(
+            model_name='answer',
+            name='question_text',
+            field=models.CharField(default='', max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='answerarchive',
+            name='question_text',
+            field=models.CharField(default='', max_length=200),
+        ),
+        migrations.RemoveField(
+            model_name='answer',
+            name='question_text',
+        ),
+        migrations.RemoveField(
+            model_name='answerarchive',
+            name='question_text',
+        ),
+        migrations.AlterField(
+            model_name='answer',
+            name='question_version',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='version_answers', to='quizzes.QuestionVersion'),
+        ),
+        migrations.AlterField(
+            model_name='answerarchive',
+            name='question_version',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_version_answers', to='quizzes.QuestionVersion'),
+        ),
+    ]
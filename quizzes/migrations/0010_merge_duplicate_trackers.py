@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_trackers(apps, schema_editor):
+    """
+    Collapse duplicate incomplete trackers for an identity and quiz into
+    the most recently started one, moving their answers across.
+    """
+    Tracker = apps.get_model('quizzes', 'Tracker')
+    Answer = apps.get_model('quizzes', 'Answer')
+    duplicates = Tracker.objects.filter(complete=False).values(
+        'identity', 'quiz').annotate(trackers=Count('id')).filter(
+        trackers__gt=1)
+    for duplicate in duplicates.iterator():
+        ids = list(Tracker.objects.filter(
+            complete=False, identity=duplicate['identity'],
+            quiz=duplicate['quiz']).order_by(
+            '-started_at').values_list('id', flat=True))
+        Answer.objects.filter(tracker_id__in=ids[1:]).update(
+            tracker_id=ids[0])
+        Tracker.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0009_remove_answer_question_text'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_trackers,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0010_merge_duplicate_trackers'),
+    ]
+
+    operations = [
+        # Django can't express partial unique indexes, this one backs the
+        # ON CONFLICT clause in TrackerManager.get_or_create_active
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX quizzes_tracker_active_uniq '
+            'ON quizzes_tracker (identity, quiz_id) WHERE NOT complete',
+            'DROP INDEX quizzes_tracker_active_uniq'),
+    ]
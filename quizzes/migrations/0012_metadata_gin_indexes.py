@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from quizzes.operations import RunSQLConcurrently
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0011_tracker_active_unique'),
+    ]
+
+    operations = [
+        # jsonb_path_ops indexes serve the @> containment queries made by
+        # quizzes.filters.JSONFieldFilterBackend. They are built
+        # concurrently so writes to the tables carry on meanwhile.
+        RunSQLConcurrently(
+            'CREATE INDEX CONCURRENTLY quizzes_quiz_metadata_gin '
+            'ON quizzes_quiz USING gin (metadata jsonb_path_ops)',
+            'DROP INDEX CONCURRENTLY quizzes_quiz_metadata_gin'),
+        RunSQLConcurrently(
+            'CREATE INDEX CONCURRENTLY quizzes_tracker_metadata_gin '
+            'ON quizzes_tracker USING gin (metadata jsonb_path_ops)',
+            'DROP INDEX CONCURRENTLY quizzes_tracker_metadata_gin'),
+    ]
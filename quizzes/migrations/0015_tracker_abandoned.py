@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-19 11:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0014_exportjob_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tracker',
+            name='abandoned',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='trackerarchive',
+            name='abandoned',
+            field=models.BooleanField(default=False),
+        ),
+        # Abandoned trackers no longer count as the active one, so the
+        # identity can start the quiz over
+        migrations.RunSQL(
+            ['DROP INDEX quizzes_tracker_active_uniq',
+             'CREATE UNIQUE INDEX quizzes_tracker_active_uniq '
+             'ON quizzes_tracker (identity, quiz_id) '
+             'WHERE NOT complete AND NOT abandoned'],
+            ['DROP INDEX quizzes_tracker_active_uniq',
+             'CREATE UNIQUE INDEX quizzes_tracker_active_uniq '
+             'ON quizzes_tracker (identity, quiz_id) WHERE NOT complete']),
+        # Backs the scan for idle trackers in ExpireTrackers
+        migrations.RunSQL(
+            'CREATE INDEX quizzes_tracker_open_started_at '
+            'ON quizzes_tracker (started_at) '
+            'WHERE NOT complete AND NOT abandoned',
+            'DROP INDEX quizzes_tracker_open_started_at'),
+    ]
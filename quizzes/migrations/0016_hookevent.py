@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-19 12:13
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0015_tracker_abandoned'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HookEvent',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('hook_id', models.IntegerField(null=True)),
+                ('target', models.URLField(max_length=255)),
+                ('payload', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('instance_id', models.CharField(max_length=64, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
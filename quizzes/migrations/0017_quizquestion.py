@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-19 12:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0016_hookevent'),
+    ]
+
+    operations = [
+        # The through model takes over the table Django created for
+        # Quiz.questions, so only the state changes here
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='QuizQuestion',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quizzes.Question')),
+                        ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quizzes.Quiz')),
+                    ],
+                    options={
+                        'db_table': 'quizzes_quiz_questions',
+                    },
+                ),
+                migrations.AlterUniqueTogether(
+                    name='quizquestion',
+                    unique_together=set([('quiz', 'question')]),
+                ),
+                migrations.AlterField(
+                    model_name='quiz',
+                    name='questions',
+                    field=models.ManyToManyField(blank=True, through='quizzes.QuizQuestion', to='quizzes.Question'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='quizquestion',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # Existing questions keep the order they were added in
+        migrations.RunSQL(
+            'UPDATE quizzes_quiz_questions SET position = numbered.position '
+            'FROM (SELECT id, row_number() OVER '
+            '(PARTITION BY quiz_id ORDER BY id) AS position '
+            'FROM quizzes_quiz_questions) AS numbered '
+            'WHERE quizzes_quiz_questions.id = numbered.id',
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterModelOptions(
+            name='quizquestion',
+            options={'ordering': ('quiz', 'position')},
+        ),
+        migrations.AlterIndexTogether(
+            name='quizquestion',
+            index_together=set([('quiz', 'position')]),
+        ),
+    ]
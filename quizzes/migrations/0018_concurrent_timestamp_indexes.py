@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from quizzes.operations import RunSQLConcurrently
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0017_quizquestion'),
+    ]
+
+    # The database side of the db_index fields added in 0006_archive,
+    # built concurrently so writes to the tables carry on meanwhile. The
+    # names are the ones Django gives them.
+    operations = [
+        RunSQLConcurrently(
+            'CREATE INDEX CONCURRENTLY quizzes_answer_created_at_95030e90_uniq '
+            'ON quizzes_answer (created_at)',
+            'DROP INDEX CONCURRENTLY quizzes_answer_created_at_95030e90_uniq'),
+        RunSQLConcurrently(
+            'CREATE INDEX CONCURRENTLY '
+            'quizzes_tracker_completed_at_c241bb87_uniq '
+            'ON quizzes_tracker (completed_at)',
+            'DROP INDEX CONCURRENTLY '
+            'quizzes_tracker_completed_at_c241bb87_uniq'),
+        RunSQLConcurrently(
+            'CREATE INDEX CONCURRENTLY quizzes_tracker_started_at_e31720e8_uniq '
+            'ON quizzes_tracker (started_at)',
+            'DROP INDEX CONCURRENTLY quizzes_tracker_started_at_e31720e8_uniq'),
+    ]
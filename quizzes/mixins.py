@@ -0,0 +1,310 @@
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, FieldError
+from django.db import models
+from django.http import HttpResponse
+from redis import RedisError
+from rest_framework import relations, serializers
+from rest_framework.response import Response
+
+from .metrics import record_cache
+from .utils import get_redis, client_key
+
+
+logger = logging.getLogger(__name__)
+
+IN_PROGRESS = b'in-progress'
+
+
+class IdempotentMixin(object):
+
+    """
+    Honours an Idempotency-Key header on POST, PUT and PATCH requests.
+
+    The first response for a key is stored in Redis for
+    settings.IDEMPOTENCY_KEY_TTL seconds and replayed for retries with
+    the same key from the same client, without running the view again.
+    Clients are told apart by their credentials or session, and requests
+    from clients with neither aren't handled here. A retry that arrives
+    while the original is still being handled gets a 409, and one with a
+    different body to the original a 422. Server errors and throttled
+    requests are not stored so they can be retried.
+    """
+    idempotent_methods = ('POST', 'PUT', 'PATCH')
+
+    def get_idempotency_key(self, request):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not key or request.method not in self.idempotent_methods:
+            return None
+        client = client_key(request)
+        if client is None:
+            return None
+        return 'idempotency:%s' % hashlib.sha1(':'.join((
+            client, request.method, request.path, key
+        )).encode('utf-8')).hexdigest()
+
+    def get_body_hash(self, request):
+        return hashlib.sha1(request.body).hexdigest()
+
+    def dispatch(self, request, *args, **kwargs):
+        key = self.get_idempotency_key(request)
+        if key is None:
+            return super(IdempotentMixin, self).dispatch(
+                request, *args, **kwargs)
+        redis = get_redis()
+        try:
+            stored = None
+            if not redis.set(key, IN_PROGRESS, nx=True,
+                             ex=settings.IDEMPOTENCY_LOCK_TTL):
+                stored = redis.get(key)
+        except RedisError:
+            logger.exception("Idempotency store unavailable")
+            return super(IdempotentMixin, self).dispatch(
+                request, *args, **kwargs)
+        record_cache('idempotency', stored is not None)
+        if stored == IN_PROGRESS:
+            return HttpResponse(
+                json.dumps({"detail": "A request with this Idempotency-Key "
+                                      "is already in progress."}),
+                status=409, content_type='application/json')
+        body = self.get_body_hash(request)
+        if stored is not None:
+            stored = json.loads(stored.decode('utf-8'))
+            if stored['body'] != body:
+                return HttpResponse(
+                    json.dumps({"detail": "This Idempotency-Key was used "
+                                          "for a request with a different "
+                                          "body."}),
+                    status=422, content_type='application/json')
+            response = HttpResponse(
+                stored['content'], status=stored['status'],
+                content_type=stored['content_type'])
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        response = None
+        try:
+            response = super(IdempotentMixin, self).dispatch(
+                request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+        finally:
+            self.store_response(redis, key, body, response)
+        return response
+
+    def store_response(self, redis, key, body, response):
+        try:
+            if response is None or response.status_code >= 500 or \
+                    response.status_code == 429:
+                redis.delete(key)
+                return
+            redis.set(key, json.dumps({
+                'body': body,
+                'status': response.status_code,
+                'content_type': response['Content-Type'],
+                'content': response.content.decode('utf-8'),
+            }), ex=settings.IDEMPOTENCY_KEY_TTL)
+        except RedisError:
+            logger.exception("Idempotency store unavailable")
+
+
+class ThrottleFirstMixin(object):
+
+    """
+    Checks the throttles with `before_authentication` set, which only read
+    the request, before authenticating it rather than after, so a client
+    over its rate gets a 429 without the token lookup or any other query.
+    The other throttles are checked as usual, once the request is
+    authenticated and permitted.
+    """
+
+    def perform_authentication(self, request):
+        self.check_throttles(request, before_authentication=True)
+        super(ThrottleFirstMixin, self).perform_authentication(request)
+
+    def check_throttles(self, request, before_authentication=False):
+        for throttle in self.get_throttles():
+            if (getattr(throttle, 'before_authentication', False) ==
+                    before_authentication and
+                    not throttle.allow_request(request, self)):
+                self.throttled(request, throttle.wait())
+
+
+class ValuesListMixin(object):
+
+    """
+    Lists from `.values()` rows instead of model instances.
+
+    Each readable serializer field is compiled once per request into the
+    column it reads and the `to_representation` it applies, and rows are
+    mapped straight to the same output the serializer would give. Primary
+    key relations take the key column, many to many ones are read from
+    the through table in one query per page. Serializers with any other
+    kind of field are listed the usual way.
+    """
+
+    def compile_values_list(self):
+        model = self.get_queryset().model
+        columns, converters = ['pk'], []
+        for field in self.get_serializer().fields.values():
+            if field.write_only:
+                continue
+            if isinstance(field, relations.ManyRelatedField):
+                child = field.child_relation
+                try:
+                    related = model._meta.get_field(field.source)
+                except FieldDoesNotExist:
+                    return None
+                if (not isinstance(child, relations.PrimaryKeyRelatedField) or
+                        not isinstance(related, models.ManyToManyField)):
+                    return None
+                convert = (child.pk_field.to_representation
+                           if child.pk_field is not None else None)
+                converters.append(
+                    (field.field_name, None, (related, convert)))
+                continue
+            if isinstance(field, relations.PrimaryKeyRelatedField):
+                convert = (field.pk_field.to_representation
+                           if field.pk_field is not None else None)
+            elif (isinstance(field, (relations.RelatedField,
+                                     serializers.SerializerMethodField,
+                                     serializers.BaseSerializer)) or
+                    field.source == '*'):
+                return None
+            else:
+                convert = field.to_representation
+            column = '__'.join(field.source_attrs)
+            columns.append(column)
+            converters.append((field.field_name, column, convert))
+        try:
+            model._default_manager.values(*columns)
+        except FieldError:
+            return None
+        return columns, converters
+
+    def represent_rows(self, rows, converters):
+        many = dict((name, self.get_many_related(rows, *related))
+                    for name, column, related in converters if column is None)
+        data = []
+        for row in rows:
+            item = OrderedDict()
+            for name, column, convert in converters:
+                if column is None:
+                    item[name] = many[name].get(row['pk'], [])
+                    continue
+                value = row[column]
+                if value is not None and convert is not None:
+                    value = convert(value)
+                item[name] = value
+            data.append(item)
+        return data
+
+    def get_many_related(self, rows, field, convert):
+        through = field.remote_field.through
+        source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        related = {}
+        # In the through model's order where it has one, like positions
+        pairs = through._default_manager.filter(**{
+            '%s__in' % source: [row['pk'] for row in rows]
+        }).order_by(*through._meta.ordering or ['pk']).values_list(
+            source, target)
+        for pk, value in pairs:
+            if convert is not None:
+                value = convert(value)
+            related.setdefault(pk, []).append(value)
+        return related
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.compile_values_list()
+        if compiled is None:
+            return super(ValuesListMixin, self).list(request, *args, **kwargs)
+        columns, converters = compiled
+        rows = self.filter_queryset(self.get_queryset()).prefetch_related(
+            None).values(*columns)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(
+                self.represent_rows(page, converters))
+        return Response(self.represent_rows(list(rows), converters))
+
+
+class SparseFieldsMixin(object):
+
+    """
+    Lets GET requests choose the fields returned with `?fields=` and leave
+    some out with `?omit=`, both comma separated. The serializer is pruned
+    to those fields and the query loads only their columns, dropping
+    joins and prefetches nothing asks for.
+    """
+
+    def is_sparse(self):
+        params = self.request.query_params
+        return self.request.method in ('GET', 'HEAD') and bool(
+            params.get('fields') or params.get('omit'))
+
+    def get_sparse_fields(self, available):
+        """
+        The names of the fields to return, or None for all of them
+        """
+        if not self.is_sparse():
+            return None
+        params = self.request.query_params
+        fields = [name for name in params.get('fields', '').split(',')
+                  if name]
+        omit = [name for name in params.get('omit', '').split(',') if name]
+        unknown = set(fields + omit) - set(available)
+        if unknown:
+            raise serializers.ValidationError({
+                "fields": ["Unknown fields: %s" % ', '.join(sorted(unknown))]
+            })
+        return set(fields or available) - set(omit)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super(SparseFieldsMixin, self).get_serializer(
+            *args, **kwargs)
+        fields = getattr(serializer, 'child', serializer).fields
+        keep = self.get_sparse_fields(list(fields))
+        if keep is not None:
+            for name in list(fields):
+                if name not in keep:
+                    fields.pop(name)
+        return serializer
+
+    def filter_queryset(self, queryset):
+        queryset = super(SparseFieldsMixin, self).filter_queryset(queryset)
+        if not self.is_sparse():
+            return queryset
+        return self.prune_queryset(queryset)
+
+    def prune_queryset(self, queryset):
+        model = queryset.model
+        columns, related, prefetch = [model._meta.pk.name], set(), set()
+        for field in self.get_serializer().fields.values():
+            if field.write_only:
+                continue
+            if isinstance(field, relations.ManyRelatedField):
+                prefetch.add(field.source)
+                continue
+            if (field.source == '*' or
+                    isinstance(field, serializers.SerializerMethodField)):
+                return queryset
+            try:
+                model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                return queryset
+            columns.append('__'.join(field.source_attrs))
+            if len(field.source_attrs) > 1:
+                related.add('__'.join(field.source_attrs[:-1]))
+        # Prefetch objects are kept by the relation they fill
+        lookups = [lookup for lookup in queryset._prefetch_related_lookups
+                   if getattr(lookup, 'prefetch_to', lookup) in prefetch]
+        queryset = queryset.prefetch_related(None).prefetch_related(*lookups)
+        # Deferred relations can't be followed with select_related
+        queryset = queryset.select_related(None)
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*columns)
@@ -2,7 +2,9 @@ import uuid
 
 from django.contrib.postgres.fields import JSONField
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import F
+from django.db.models.signals import post_save
 from django.utils.encoding import python_2_unicode_compatible
 
 
@@ -33,6 +35,38 @@ class Question(models.Model):
                                    null=True)
     user = property(lambda self: self.created_by)
 
+    def snapshot(self):
+        """
+        The content of this question as QuestionVersion fields
+        """
+        return {
+            'question_type': self.question_type,
+            'question_text': self.question,
+            'answers': self.answers,
+            'response_correct': self.response_correct,
+            'response_incorrect': self.response_incorrect
+        }
+
+    def save(self, *args, **kwargs):
+        """
+        Bumps the version and writes a QuestionVersion snapshot whenever
+        the content of the question changes, or its version no longer has
+        a snapshot to answer against.
+        """
+        with transaction.atomic():
+            latest = None
+            if not self._state.adding:
+                latest = self.versions.order_by('-version').first()
+            if latest is not None and latest.version == self.version and \
+                    latest.snapshot() == self.snapshot():
+                return super(Question, self).save(*args, **kwargs)
+            if latest is not None:
+                self.version = max(self.version, latest.version + 1)
+            super(Question, self).save(*args, **kwargs)
+            QuestionVersion.objects.create(
+                question=self, version=self.version,
+                created_by=self.updated_by, **self.snapshot())
+
     def serialize_hook(self, hook):
         # optional, there are serialization defaults
         # we recommend always sending the Hook
@@ -59,6 +93,54 @@ class Question(models.Model):
         return str(self.id)
 
 
+@python_2_unicode_compatible
+class QuestionVersion(models.Model):
+    """
+    Immutable snapshot of the content of a Question at a version, which
+    Answers reference instead of copying the question text
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    question = models.ForeignKey(Question, related_name='versions')
+    version = models.IntegerField()
+    question_type = models.CharField(max_length=50,
+                                     choices=Question.QUESTION_TYPE_CHOICES)
+    question_text = models.CharField(max_length=255)
+    answers = JSONField(null=True, blank=True)
+    response_correct = models.CharField(max_length=200)
+    response_incorrect = models.CharField(max_length=200)
+    created_at = models.DateTimeField(auto_now_add=True)
+    created_by = models.ForeignKey(User, related_name='+', null=True)
+
+    class Meta:
+        unique_together = (('question', 'version'),)
+
+    def snapshot(self):
+        return {
+            'question_type': self.question_type,
+            'question_text': self.question_text,
+            'answers': self.answers,
+            'response_correct': self.response_correct,
+            'response_incorrect': self.response_incorrect
+        }
+
+    def __str__(self):  # __unicode__ on Python 2
+        return "%s v%s" % (self.question_id, self.version)
+
+
+class QuizManager(models.Manager):
+
+    def with_questions(self):
+        """
+        Quizzes with their questions prefetched in position order
+        """
+        # The prefetch already joins the through table, ordering by its
+        # column directly saves joining it again
+        ordered = Question.objects.extra(
+            order_by=['%s.position' % QuizQuestion._meta.db_table])
+        return self.prefetch_related(
+            models.Prefetch('questions', queryset=ordered))
+
+
 @python_2_unicode_compatible
 class Quiz(models.Model):
 
@@ -70,7 +152,8 @@ class Quiz(models.Model):
     active = models.BooleanField(default=False)
     archived = models.BooleanField(default=False)
     metadata = JSONField(null=True, blank=True)
-    questions = models.ManyToManyField(Question, blank=True)
+    questions = models.ManyToManyField(Question, blank=True,
+                                       through='QuizQuestion')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(User, related_name='quizzes_created',
@@ -79,6 +162,8 @@ class Quiz(models.Model):
                                    null=True)
     user = property(lambda self: self.created_by)
 
+    objects = QuizManager()
+
     def serialize_hook(self, hook):
         # optional, there are serialization defaults
         # we recommend always sending the Hook
@@ -98,10 +183,88 @@ class Quiz(models.Model):
             }
         }
 
+    def set_questions(self, questions):
+        """
+        Replaces the quiz's questions, given as questions or their ids,
+        numbering them from 1 in the order given
+        """
+        ordered = []
+        for question in questions:
+            question_id = getattr(question, 'pk', question)
+            if question_id not in ordered:
+                ordered.append(question_id)
+        with transaction.atomic():
+            QuizQuestion.objects.filter(quiz=self).delete()
+            QuizQuestion.objects.bulk_create([
+                QuizQuestion(quiz=self, question_id=question_id,
+                             position=position)
+                for position, question_id in enumerate(ordered, 1)])
+        getattr(self, '_prefetched_objects_cache', {}).pop('questions', None)
+
     def __str__(self):  # __unicode__ on Python 2
         return str(self.id)
 
 
+class QuizQuestion(models.Model):
+
+    """
+    A question's place in a quiz, numbered from 1. Positions aren't
+    unique, so reordering can renumber rows in any order; Quiz.set_questions
+    and QuizViewSet.reorder keep them a sequence. Deleting a question, or
+    editing positions in the admin, can leave gaps, so questions are
+    looked up by their place in position order rather than their number.
+    """
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    position = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'quizzes_quiz_questions'
+        unique_together = (('quiz', 'question'),)
+        index_together = (('quiz', 'position'),)
+        ordering = ('quiz', 'position')
+
+
+class TrackerManager(models.Manager):
+
+    def get_or_create_active(self, identity, quiz, **fields):
+        """
+        Returns (tracker, created) for the incomplete tracker of `identity`
+        on `quiz`, inserting one with INSERT ... ON CONFLICT DO NOTHING
+        against the partial unique index on incomplete trackers, so
+        concurrent retries can neither race nor create duplicates.
+        Abandoned trackers are left behind and a new one started.
+        """
+        tracker = self.model(identity=identity, quiz=quiz, **fields)
+        db = router.db_for_write(self.model)
+        connection = connections[db]
+        opts = self.model._meta
+        columns, values = [], []
+        for field in opts.concrete_fields:
+            columns.append(connection.ops.quote_name(field.column))
+            values.append(field.get_db_prep_save(
+                field.pre_save(tracker, True), connection=connection))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO %s (%s) VALUES (%s) '
+                'ON CONFLICT (identity, quiz_id) '
+                'WHERE NOT complete AND NOT abandoned '
+                'DO NOTHING RETURNING id' % (
+                    opts.db_table, ', '.join(columns),
+                    ', '.join(['%s'] * len(values))),
+                values)
+            created = cursor.fetchone() is not None
+        if not created:
+            return self.using(db).get(
+                identity=identity, quiz=quiz, complete=False,
+                abandoned=False), False
+        tracker._state.adding = False
+        tracker._state.db = db
+        post_save.send(sender=self.model, instance=tracker, created=True,
+                       update_fields=None, raw=False, using=db)
+        return tracker, True
+
+
 @python_2_unicode_compatible
 class Tracker(models.Model):
 
@@ -112,15 +275,18 @@ class Tracker(models.Model):
     identity = models.UUIDField()
     quiz = models.ForeignKey(Quiz, related_name='quiz_takers')
     complete = models.BooleanField(default=False)
+    abandoned = models.BooleanField(default=False)
     metadata = JSONField(null=True, blank=True)
-    started_at = models.DateTimeField(auto_now_add=True)
-    completed_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    completed_at = models.DateTimeField(null=True, blank=True, db_index=True)
     created_by = models.ForeignKey(User, related_name='trackers_created',
                                    null=True)
     updated_by = models.ForeignKey(User, related_name='trackers_updated',
                                    null=True)
     user = property(lambda self: self.created_by)
 
+    objects = TrackerManager()
+
     def __str__(self):  # __unicode__ on Python 2
         return str(self.id)
 
@@ -133,12 +299,13 @@ class Answer(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     version = models.IntegerField(default=1)
     question = models.ForeignKey(Question, related_name='questions_answers')
-    question_text = models.CharField(max_length=200)
+    question_version = models.ForeignKey(QuestionVersion,
+                                         related_name='version_answers')
     answer_value = models.CharField(max_length=100)
     answer_text = models.CharField(max_length=200)
     answer_correct = models.BooleanField(default=False)
     response_sent = models.CharField(max_length=200)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(User, related_name='answers_created',
                                    null=True)
@@ -146,6 +313,135 @@ class Answer(models.Model):
                                    null=True)
     tracker = models.ForeignKey(Tracker, related_name='answers')
     user = property(lambda self: self.created_by)
+    question_text = property(
+        lambda self: self.question_version.question_text)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remembered so leaderboards can tell when an answer's correctness
+        # changes on save
+        instance = super(Answer, cls).from_db(db, field_names, values)
+        instance._loaded_correct = dict(
+            zip(field_names, values)).get('answer_correct')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Answers reference the snapshot of the version of the question
+        current at the time they are recorded.
+        """
+        if self.question_version_id is None:
+            self.question_version = QuestionVersion.objects.get(
+                question_id=self.question_id, version=F('question__version'))
+        super(Answer, self).save(*args, **kwargs)
+
+    def __str__(self):  # __unicode__ on Python 2
+        return str(self.id)
+
+
+@python_2_unicode_compatible
+class TrackerArchive(models.Model):
+
+    """
+    Historical Tracker rows moved out of the hot table by the archive task
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    identity = models.UUIDField()
+    quiz = models.ForeignKey(Quiz, related_name='archived_takers')
+    complete = models.BooleanField(default=False)
+    abandoned = models.BooleanField(default=False)
+    metadata = JSONField(null=True, blank=True)
+    started_at = models.DateTimeField(db_index=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(User, related_name='+', null=True)
+    updated_by = models.ForeignKey(User, related_name='+', null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):  # __unicode__ on Python 2
+        return str(self.id)
+
+
+@python_2_unicode_compatible
+class AnswerArchive(models.Model):
+    """
+    Historical Answer rows moved out of the hot table with their tracker
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    version = models.IntegerField(default=1)
+    question = models.ForeignKey(Question, related_name='archived_answers')
+    question_version = models.ForeignKey(
+        QuestionVersion, related_name='archived_version_answers')
+    answer_value = models.CharField(max_length=100)
+    answer_text = models.CharField(max_length=200)
+    answer_correct = models.BooleanField(default=False)
+    response_sent = models.CharField(max_length=200)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    created_by = models.ForeignKey(User, related_name='+', null=True)
+    updated_by = models.ForeignKey(User, related_name='+', null=True)
+    tracker = models.ForeignKey(TrackerArchive, related_name='answers')
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):  # __unicode__ on Python 2
+        return str(self.id)
+
+
+@python_2_unicode_compatible
+class ExportJob(models.Model):
+    """
+    A tracker results export written to file storage by a Celery task,
+    optionally restricted to a quiz and to trackers started in a window
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (COMPLETE, "Complete"),
+        (FAILED, "Failed")
+    )
+    FORMAT_CHOICES = (
+        ('csv', "CSV"),
+        ('ndjson', "Newline-delimited JSON"),
+        ('parquet', "Parquet")
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES,
+                              default='csv')
+    quiz = models.ForeignKey(Quiz, related_name='export_jobs', null=True,
+                             blank=True)
+    started_after = models.DateTimeField(null=True, blank=True)
+    started_before = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING)
+    rows = models.IntegerField(default=0)
+    total = models.IntegerField(null=True, blank=True)
+    file = models.FileField(upload_to='exports', null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(User, related_name='export_jobs_created',
+                                   null=True)
+
+    def __str__(self):  # __unicode__ on Python 2
+        return str(self.id)
+
+
+@python_2_unicode_compatible
+class HookEvent(models.Model):
+    """
+    A webhook delivery waiting in the outbox. Written in the transaction
+    of the change it reports, so it exists only if the change commits,
+    and handed to Celery by the relay_hook_events command.
+    """
+    id = models.AutoField(primary_key=True)
+    hook_id = models.IntegerField(null=True)
+    target = models.URLField(max_length=255)
+    payload = JSONField()
+    instance_id = models.CharField(max_length=64, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):  # __unicode__ on Python 2
         return str(self.id)
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+class RunSQLConcurrently(migrations.RunSQL):
+
+    """
+    RunSQL for statements Postgres won't run in a transaction, like CREATE
+    and DROP INDEX CONCURRENTLY, which build and drop indexes without
+    blocking writes to the table.
+
+    Django 1.9 runs each migration in a single transaction, which is
+    committed before the statements run and begun again after, so a
+    migration using this should have no other operations: those before
+    it couldn't be rolled back if it fails.
+    """
+
+    def _run_sql(self, schema_editor, sqls):
+        atomic = getattr(schema_editor, 'atomic', None)
+        if atomic is None:
+            return super(RunSQLConcurrently, self)._run_sql(
+                schema_editor, sqls)
+        atomic.__exit__(None, None, None)
+        try:
+            super(RunSQLConcurrently, self)._run_sql(schema_editor, sqls)
+        finally:
+            atomic.__enter__()
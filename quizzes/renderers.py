@@ -0,0 +1,55 @@
+from __future__ import unicode_literals
+
+import datetime
+import decimal
+import uuid
+
+from django.utils import six
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def encode_datetime(obj):
+    representation = obj.isoformat()
+    if obj.microsecond:
+        representation = representation[:23] + representation[26:]
+    if representation.endswith('+00:00'):
+        representation = representation[:-6] + 'Z'
+    return representation
+
+
+class FastJSONEncoder(JSONEncoder):
+    """
+    DRF's JSONEncoder with a lookup on the exact type for the values API
+    payloads are full of, instead of DRF's chain of isinstance checks.
+    Anything else, subclasses included, goes down DRF's chain, so the
+    output is the same. UUIDs repeat a lot within a payload, answers
+    pointing at the same trackers and questions, so their text is kept
+    for the rest of the encoding.
+    """
+
+    encoders = {
+        datetime.datetime: encode_datetime,
+        datetime.date: lambda obj: obj.isoformat(),
+        decimal.Decimal: float,
+    }
+
+    def __init__(self, *args, **kwargs):
+        super(FastJSONEncoder, self).__init__(*args, **kwargs)
+        self.uuids = {}
+
+    def default(self, obj):
+        if type(obj) is uuid.UUID:
+            try:
+                return self.uuids[obj]
+            except KeyError:
+                text = self.uuids[obj] = six.text_type(obj)
+                return text
+        encode = self.encoders.get(type(obj))
+        if encode is not None:
+            return encode(obj)
+        return super(FastJSONEncoder, self).default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    encoder_class = FastJSONEncoder
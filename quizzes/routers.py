@@ -0,0 +1,55 @@
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+_state = threading.local()
+
+
+def replicas_allowed():
+    return getattr(_state, 'replicas', False)
+
+
+def allow_replicas(allowed):
+    """
+    Lets reads in this thread go to the replicas, or keeps them on the
+    primary. Reads only use the replicas once allowed, by
+    ReplicaMiddleware for a request or read_from_replicas for a block.
+    """
+    _state.replicas = allowed
+
+
+@contextmanager
+def read_from_replicas():
+    previous = replicas_allowed()
+    allow_replicas(True)
+    try:
+        yield
+    finally:
+        allow_replicas(previous)
+
+
+class ReplicaRouter(object):
+
+    """
+    Sends reads to a random one of settings.REPLICA_DATABASES where that
+    is allowed, and everything else to the primary. With no replicas
+    configured it leaves routing to Django.
+    """
+
+    def db_for_read(self, model, **hints):
+        if settings.REPLICA_DATABASES and replicas_allowed():
+            return random.choice(settings.REPLICA_DATABASES)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
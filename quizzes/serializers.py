@@ -1,9 +1,14 @@
-from .models import Quiz, Question, Tracker, Answer
+from . import exports
+from .models import Quiz, Question, Tracker, Answer, ExportJob
 from rest_hooks.models import Hook
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 
 
 class QuizSerializer(serializers.ModelSerializer):
+    # Listed in position order, and written in the order given
+    questions = serializers.PrimaryKeyRelatedField(
+        many=True, queryset=Question.objects.all(), required=False)
 
     class Meta:
         model = Quiz
@@ -12,12 +17,41 @@ class QuizSerializer(serializers.ModelSerializer):
                   'archived', 'created_at', 'created_by', 'updated_at',
                   'updated_by')
 
+    def create(self, validated_data):
+        questions = validated_data.pop('questions', [])
+        quiz = super(QuizSerializer, self).create(validated_data)
+        quiz.set_questions(questions)
+        return self.reload(quiz)
+
+    def update(self, instance, validated_data):
+        questions = validated_data.pop('questions', None)
+        quiz = super(QuizSerializer, self).update(instance, validated_data)
+        if questions is None:
+            return quiz
+        quiz.set_questions(questions)
+        return self.reload(quiz)
+
+    def reload(self, quiz):
+        # Unprefetched, quiz.questions would be listed out of position order
+        return Quiz.objects.with_questions().get(pk=quiz.pk)
+
+
+class QuizQuestionOrderSerializer(serializers.Serializer):
+    questions = serializers.ListField(child=serializers.UUIDField())
+
+    def validate_questions(self, value):
+        current = set(self.context['questions'])
+        if len(value) != len(current) or set(value) != current:
+            raise serializers.ValidationError(
+                "Must list each of the quiz's questions once.")
+        return value
+
 
 class QuestionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Question
-        read_only_fields = ('created_at', 'updated_at')
+        read_only_fields = ('version', 'created_at', 'updated_at')
         fields = ('id', 'version', 'question_type', 'question', 'answers',
                   'response_correct', 'response_incorrect', 'active',
                   'created_at', 'created_by', 'updated_at', 'updated_by')
@@ -27,21 +61,66 @@ class TrackerSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Tracker
-        read_only_fields = ('started_at', )
-        fields = ('id', 'identity', 'quiz', 'complete', 'metadata',
-                  'started_at', 'created_by', 'completed_at', 'updated_by')
+        read_only_fields = ('abandoned', 'started_at', )
+        fields = ('id', 'identity', 'quiz', 'complete', 'abandoned',
+                  'metadata', 'started_at', 'created_by', 'completed_at',
+                  'updated_by')
 
 
 class AnswerSerializer(serializers.ModelSerializer):
+    question_text = serializers.CharField(
+        source='question_version.question_text', read_only=True)
 
     class Meta:
         model = Answer
-        read_only_fields = ('created_at', 'updated_at')
-        fields = ('id', 'version', 'question', 'question_text', 'answer_value',
-                  'answer_text', 'answer_correct', 'response_sent', 'tracker',
+        read_only_fields = ('question_version', 'created_at', 'updated_at')
+        fields = ('id', 'version', 'question', 'question_version',
+                  'question_text', 'answer_value', 'answer_text',
+                  'answer_correct', 'response_sent', 'tracker',
                   'created_at', 'created_by', 'updated_at', 'updated_by')
 
 
+class QueuedAnswerSerializer(AnswerSerializer):
+    """
+    Validates an answer for the ingestion queue without touching the
+    database, its question and tracker are checked as it is written
+    """
+    question = serializers.UUIDField(source='question_id')
+    tracker = serializers.UUIDField(source='tracker_id')
+
+    class Meta(AnswerSerializer.Meta):
+        fields = ('id', 'version', 'question', 'answer_value', 'answer_text',
+                  'answer_correct', 'response_sent', 'tracker')
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    started_at__gte = serializers.DateTimeField(
+        source='started_after', required=False, allow_null=True)
+    started_at__lt = serializers.DateTimeField(
+        source='started_before', required=False, allow_null=True)
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        read_only_fields = ('status', 'rows', 'total', 'error', 'created_at',
+                            'completed_at', 'created_by')
+        fields = ('id', 'format', 'quiz', 'started_at__gte',
+                  'started_at__lt', 'status', 'rows', 'total', 'download',
+                  'error', 'created_at', 'completed_at', 'created_by')
+
+    def validate_format(self, value):
+        if value == 'parquet' and exports.pyarrow is None:
+            raise serializers.ValidationError(
+                "Parquet exports need pyarrow installed.")
+        return value
+
+    def get_download(self, obj):
+        if obj.status != ExportJob.COMPLETE:
+            return None
+        return reverse('exportjob-download', args=[obj.id],
+                       request=self.context.get('request'))
+
+
 class HookSerializer(serializers.ModelSerializer):
 
     class Meta:
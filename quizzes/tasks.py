@@ -1,16 +1,41 @@
 import json
+import random
 import requests
+import tempfile
 import uuid
+from datetime import timedelta
+from timeit import default_timer as timer
 
 from celery.task import Task
 from celery.utils.log import get_task_logger
 from django.conf import settings
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import exports, ingestion
+from .circuit import CircuitBreaker
+from .metrics import HOOK_DELIVERIES
+from .models import (Tracker, Answer, TrackerArchive, AnswerArchive,
+                     ExportJob, HookEvent)
+from .routers import read_from_replicas
 
 
 logger = get_task_logger(__name__)
 
 
 class DeliverHook(Task):
+
+    """
+    Posts a webhook payload to its target, through a circuit breaker per
+    target. While a target's circuit is open deliveries to it are put
+    back on the queue until the circuit lets a probe through, up to
+    settings.HOOK_DEFER_RETRIES times, instead of tying up workers
+    waiting on a target that is down.
+    """
+
     def run(self, target, payload, instance_id=None, hook_id=None, **kwargs):
         """
         target:     the url to receive the payload.
@@ -18,17 +43,47 @@ class DeliverHook(Task):
         instance_id:   a possibly None "trigger" instance ID
         hook_id:       the ID of defining Hook object
         """
-        requests.post(
-            url=target,
-            data=json.dumps(payload),
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': 'Token %s' % settings.HOOK_AUTH_TOKEN
-            }
-        )
+        circuit = CircuitBreaker(target)
+        if not circuit.allow():
+            HOOK_DELIVERIES.labels('circuit-open').observe(0)
+            if self.request.retries >= settings.HOOK_DEFER_RETRIES:
+                logger.warning("Dropped hook delivery to %s, its circuit "
+                               "is open" % target)
+                return
+            # Spread retries out so they don't all arrive at once
+            raise self.retry(
+                countdown=circuit.retry_after() + random.randint(0, 10),
+                max_retries=settings.HOOK_DEFER_RETRIES)
+
+        start = timer()
+        outcome = 'error'
+        try:
+            response = requests.post(
+                url=target,
+                data=json.dumps(payload),
+                headers={
+                    'Content-Type': 'application/json',
+                    'Authorization': 'Token %s' % settings.HOOK_AUTH_TOKEN
+                },
+                timeout=settings.HOOK_TIMEOUT
+            )
+            outcome = '%sxx' % (response.status_code // 100)
+        except requests.RequestException:
+            circuit.failure()
+            raise
+        finally:
+            HOOK_DELIVERIES.labels(outcome).observe(timer() - start)
+        if response.status_code >= 500:
+            circuit.failure()
+        else:
+            circuit.success()
 
 
 def deliver_hook_wrapper(target, payload, instance, hook):
+    """
+    Puts the delivery in the outbox, in the transaction of the change that
+    fired it. RelayHookEvents hands it to DeliverHook.
+    """
     if instance is not None:
         if isinstance(instance.id, uuid.UUID):
             instance_id = str(instance.id)
@@ -36,6 +91,226 @@ def deliver_hook_wrapper(target, payload, instance, hook):
             instance_id = instance.id
     else:
         instance_id = None
-    kwargs = dict(target=target, payload=payload,
-                  instance_id=instance_id, hook_id=hook.id)
-    DeliverHook.apply_async(kwargs=kwargs)
+    # Model payloads hold UUIDs and datetimes the JSON column can't
+    payload = json.loads(json.dumps(payload, cls=DjangoJSONEncoder))
+    HookEvent.objects.create(target=target, payload=payload,
+                             instance_id=instance_id, hook_id=hook.id)
+
+
+class RelayHookEvents(Task):
+
+    """
+    Moves deliveries from the outbox onto the Celery queue, a batch at a
+    time. Each batch is deleted from the outbox with FOR UPDATE SKIP
+    LOCKED, so relays can run side by side, and published over one broker
+    connection before the delete commits: a failed publish leaves the
+    batch in the outbox, so every event is delivered at least once.
+    """
+
+    def run(self, batch_size=None, **kwargs):
+        """
+        batch_size: events published per transaction, defaults to
+                    settings.HOOK_RELAY_BATCH_SIZE
+
+        Returns the number of events relayed, stopping when the outbox is
+        empty.
+        """
+        batch_size = batch_size or settings.HOOK_RELAY_BATCH_SIZE
+        table = HookEvent._meta.db_table
+        relayed = 0
+        while True:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'DELETE FROM %s WHERE id IN (SELECT id FROM %s '
+                        'ORDER BY id LIMIT %%s FOR UPDATE SKIP LOCKED) '
+                        'RETURNING id, target, payload, instance_id, '
+                        'hook_id' % (table, table), [batch_size])
+                    events = sorted(cursor.fetchall())
+                if not events:
+                    break
+                with self.app.producer_or_acquire() as producer:
+                    for _, target, payload, instance_id, hook_id in events:
+                        DeliverHook.apply_async(kwargs=dict(
+                            target=target, payload=payload,
+                            instance_id=instance_id, hook_id=hook_id),
+                            producer=producer)
+            relayed += len(events)
+            if len(events) < batch_size:
+                break
+        return relayed
+
+
+class IngestAnswers(Task):
+
+    """
+    Drains the answer ingestion queue, see quizzes.ingestion
+    """
+
+    def run(self, batch_size=None, **kwargs):
+        """
+        batch_size: answers written per bulk insert, defaults to
+                    settings.ANSWER_INGEST_BATCH_SIZE
+
+        Returns the number of answers taken off the queue, None if another
+        drain was running.
+        """
+        batch_size = batch_size or settings.ANSWER_INGEST_BATCH_SIZE
+        drained = ingestion.drain(batch_size)
+        # Answers queued as the drain finished may have had their drain
+        # turned away by this one
+        if drained is not None and ingestion.queued():
+            self.apply_async()
+        return drained
+
+
+def _copy_rows(model, archive_model, column, ids):
+    """
+    Copies the rows of `model` whose `column` is in `ids` into
+    `archive_model` with a single INSERT ... SELECT.
+    """
+    columns = ', '.join(
+        connection.ops.quote_name(f.column)
+        for f in archive_model._meta.concrete_fields
+        if f.name != 'archived_at')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO %s (%s, archived_at) SELECT %s, %%s FROM %s '
+            'WHERE %s = ANY(%%s)' % (
+                archive_model._meta.db_table, columns, columns,
+                model._meta.db_table, connection.ops.quote_name(column)),
+            [timezone.now(), ids])
+
+
+def _delete_rows(model, column, ids):
+    """
+    Deletes the rows of `model` whose `column` is in `ids` directly, so
+    archiving does not fire per-row delete signals and hook events.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE %s = ANY(%%s)' % (
+            model._meta.db_table, connection.ops.quote_name(column)), [ids])
+
+
+class ArchiveTrackers(Task):
+
+    """
+    Moves finished trackers, complete or abandoned, started before the
+    archive cutoff, together with their answers, out of the hot tables and
+    into the archive tables. Open trackers stay, so they can still be
+    answered.
+    """
+
+    def run(self, days=None, batch_size=None, **kwargs):
+        """
+        days:       archive trackers started more than this many days ago,
+                    defaults to settings.ARCHIVE_AFTER_DAYS
+        batch_size: trackers moved per transaction, defaults to
+                    settings.ARCHIVE_BATCH_SIZE
+        """
+        days = days or settings.ARCHIVE_AFTER_DAYS
+        batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+        cutoff = timezone.now() - timedelta(days=days)
+        moved = 0
+        while True:
+            with transaction.atomic():
+                ids = list(Tracker.objects.filter(
+                    Q(complete=True) | Q(abandoned=True),
+                    started_at__lt=cutoff).order_by(
+                    'started_at').values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                _copy_rows(Tracker, TrackerArchive, 'id', ids)
+                _copy_rows(Answer, AnswerArchive, 'tracker_id', ids)
+                _delete_rows(Answer, 'tracker_id', ids)
+                _delete_rows(Tracker, 'id', ids)
+            moved += len(ids)
+        logger.info("Archived %s trackers started before %s" % (
+            moved, cutoff.isoformat()))
+        return moved
+
+
+class ExpireTrackers(Task):
+
+    """
+    Marks incomplete trackers abandoned once they have been idle, neither
+    started nor answered, for longer than the abandon timeout. Each batch
+    is a single UPDATE ... WHERE id IN (SELECT ... LIMIT n) committed on
+    its own, so only the rows of a batch are locked at a time.
+    """
+
+    def run(self, hours=None, batch_size=None, **kwargs):
+        """
+        hours:      abandon trackers idle for more than this many hours,
+                    defaults to settings.ABANDON_AFTER_HOURS
+        batch_size: trackers marked per statement, defaults to
+                    settings.ABANDON_BATCH_SIZE
+        """
+        hours = hours or settings.ABANDON_AFTER_HOURS
+        batch_size = batch_size or settings.ABANDON_BATCH_SIZE
+        cutoff = timezone.now() - timedelta(hours=hours)
+        idle = Tracker.objects.filter(
+            complete=False, abandoned=False, started_at__lt=cutoff).exclude(
+            answers__created_at__gte=cutoff).order_by('started_at')
+        marked = 0
+        while True:
+            # Completion is checked again on the rows themselves, in case a
+            # tracker finishes while its batch is being picked
+            updated = Tracker.objects.filter(
+                id__in=idle.values('id')[:batch_size],
+                complete=False).update(abandoned=True)
+            marked += updated
+            if updated < batch_size:
+                break
+        logger.info("Marked %s trackers idle since %s abandoned" % (
+            marked, cutoff.isoformat()))
+        return marked
+
+
+class ExportAnswers(Task):
+
+    """
+    Writes the results export of an ExportJob to file storage in its
+    format, a batch of rows at a time, recording progress on the job as it
+    goes.
+    """
+
+    def run(self, job_id, batch_size=None, **kwargs):
+        """
+        job_id:     the ExportJob to run
+        batch_size: rows fetched and written at a time, defaults to
+                    settings.EXPORT_BATCH_SIZE
+        """
+        batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+        job = ExportJob.objects.get(id=job_id)
+        window = {
+            'quiz': job.quiz_id,
+            'started_at__gte': job.started_after,
+            'started_at__lt': job.started_before,
+        }
+        jobs = ExportJob.objects.filter(id=job.id)
+        try:
+            # The answers are read from a replica, when there is one
+            with read_from_replicas():
+                total = exports.count_answers(**window)
+            jobs.update(status=ExportJob.RUNNING, total=total)
+            with tempfile.TemporaryFile() as f, read_from_replicas():
+                writer = exports.WRITERS[job.format](f)
+                rows = 0
+                for batch in exports.iter_row_batches(batch_size, **window):
+                    writer.write(batch)
+                    rows += len(batch)
+                    jobs.update(rows=rows)
+                writer.close()
+                f.seek(0)
+                job.file.save('%s.%s' % (job.id, writer.extension), File(f),
+                              save=False)
+        except Exception as exc:
+            jobs.update(status=ExportJob.FAILED, error=str(exc),
+                        completed_at=timezone.now())
+            raise
+        jobs.update(status=ExportJob.COMPLETE, file=job.file.name,
+                    completed_at=timezone.now())
+        logger.info("Exported %s answers for export job %s" % (
+            rows, job.id))
+        return rows
@@ -0,0 +1,162 @@
+import json
+from datetime import timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import Quiz, Question, Tracker, Answer, ExportJob
+from .tests import AuthenticatedAPITestCase
+
+IDENTITY = "b45d17b6-1291-4825-bfb9-446f6f853dae"
+
+
+class TestQueryBudgets(AuthenticatedAPITestCase):
+
+    """
+    Every endpoint must make the same number of queries however many rows
+    it returns, so per-row queries fail the build as soon as they appear.
+    """
+    sizes = (1, 3, 10)
+
+    def make_rows(self, count):
+        """
+        Adds `count` quizzes, each with two questions and a tracker for
+        IDENTITY holding an answer to each question.
+        """
+        for _ in range(count):
+            quiz = Quiz.objects.create(description="A quiz", active=True,
+                                       metadata={"lang": "en"})
+            questions = [
+                Question.objects.create(
+                    question_type="freetext", question="Q%s" % n,
+                    response_correct="Yes", response_incorrect="No")
+                for n in range(2)]
+            quiz.set_questions(questions)
+            tracker = Tracker.objects.create(
+                identity=IDENTITY, quiz=quiz, complete=True,
+                completed_at=timezone.now())
+            for question in questions:
+                Answer.objects.create(
+                    question=question, tracker=tracker, answer_value="a",
+                    answer_text="A", response_sent="Yes")
+
+    def assertConstantQueries(self, request):
+        counts = []
+        made = 0
+        for size in self.sizes:
+            self.make_rows(size - made)
+            made = size
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+            self.assertLess(response.status_code, 400, response.content)
+            counts.append(len(queries))
+        self.assertEqual(
+            len(set(counts)), 1,
+            "Query count grew with the number of rows: %s for %s rows" % (
+                counts, self.sizes))
+
+    def test_quiz_list(self):
+        self.assertConstantQueries(lambda: self.client.get('/api/v1/quiz/'))
+
+    def test_quiz_retrieve(self):
+        self.assertConstantQueries(lambda: self.client.get(
+            '/api/v1/quiz/%s/' % Quiz.objects.last().id))
+
+    def test_quiz_create(self):
+        self.assertConstantQueries(lambda: self.client.post(
+            '/api/v1/quiz/', json.dumps({
+                "description": "Another quiz",
+                "questions": [str(Question.objects.last().id)]
+            }), content_type='application/json'))
+
+    def test_question_list(self):
+        self.assertConstantQueries(
+            lambda: self.client.get('/api/v1/question/'))
+
+    def test_question_retrieve(self):
+        self.assertConstantQueries(lambda: self.client.get(
+            '/api/v1/question/%s/' % Question.objects.last().id))
+
+    def test_question_create(self):
+        self.assertConstantQueries(lambda: self.client.post(
+            '/api/v1/question/', json.dumps({
+                "question_type": "freetext",
+                "question": "Who is tallest?",
+                "response_correct": "Yes",
+                "response_incorrect": "No"
+            }), content_type='application/json'))
+
+    def test_tracker_list(self):
+        self.assertConstantQueries(
+            lambda: self.client.get('/api/v1/tracker/'))
+
+    def test_tracker_retrieve(self):
+        self.assertConstantQueries(lambda: self.client.get(
+            '/api/v1/tracker/%s/' % Tracker.objects.last().id))
+
+    def test_tracker_create(self):
+        self.assertConstantQueries(lambda: self.client.post(
+            '/api/v1/tracker/', json.dumps({
+                "identity": IDENTITY,
+                "quiz": str(Quiz.objects.last().id),
+                "complete": True
+            }), content_type='application/json'))
+
+    def test_tracker_get_or_create(self):
+        quiz = Quiz.objects.create(description="Retried quiz")
+        Tracker.objects.create(identity=IDENTITY, quiz=quiz)
+        self.assertConstantQueries(lambda: self.client.post(
+            '/api/v1/tracker/get-or-create/', json.dumps({
+                "identity": IDENTITY,
+                "quiz": str(quiz.id)
+            }), content_type='application/json'))
+
+    def test_answer_list(self):
+        self.assertConstantQueries(lambda: self.client.get('/api/v1/answer/'))
+
+    def test_answer_retrieve(self):
+        self.assertConstantQueries(lambda: self.client.get(
+            '/api/v1/answer/%s/' % Answer.objects.last().id))
+
+    def test_answer_create(self):
+        def request():
+            answer = Answer.objects.last()
+            return self.client.post('/api/v1/answer/', json.dumps({
+                "question": str(answer.question_id),
+                "tracker": str(answer.tracker_id),
+                "answer_value": "b",
+                "answer_text": "B",
+                "response_sent": "No"
+            }), content_type='application/json')
+        self.assertConstantQueries(request)
+
+    def test_quizzes_untaken(self):
+        # Other identities' trackers leave every quiz untaken
+        self.assertConstantQueries(lambda: self.client.get(
+            '/api/v1/quiz/untaken',
+            {"identity": "a45d17b6-1291-4825-bfb9-446f6f853dae"}))
+
+    def test_stats(self):
+        self.assertConstantQueries(lambda: self.client.get('/api/v1/stats'))
+
+    def test_export(self):
+        self.assertConstantQueries(lambda: self.client.get(
+            '/api/v1/tracker/export'))
+
+    def test_export_window(self):
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        self.assertConstantQueries(lambda: self.client.get(
+            '/api/v1/tracker/export', {"started_at__gte": since}))
+
+    def test_export_job_create(self):
+        # Runs the export too, as Celery is eager in tests
+        self.assertConstantQueries(lambda: self.client.post(
+            '/api/v1/export/', {}, format='json'))
+
+    def test_export_job_list(self):
+        def request():
+            ExportJob.objects.create(quiz=Quiz.objects.last(),
+                                     created_by=self.user)
+            return self.client.get('/api/v1/export/')
+        self.assertConstantQueries(request)
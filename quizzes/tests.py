@@ -1,14 +1,46 @@
+import gzip
 import json
-from datetime import datetime
+import responses
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import skipIf
 
+from celery.exceptions import Retry
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
-from rest_framework import status
+from django.core.management import call_command
+from django.db import connection, transaction, IntegrityError
+from django.db.utils import ConnectionDoesNotExist
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import six, timezone
+from django.utils.translation import ugettext_lazy
+from prometheus_client import REGISTRY
+from redis import StrictRedis
+from rest_framework import serializers, status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 from rest_framework.authtoken.models import Token
 from rest_hooks.models import Hook
 
-from .models import Quiz, Question, Tracker, Answer
+from . import exports, hooks, ingestion, leaderboards, utils
+from .admin import EstimatedCountPaginator
+from .exports import pyarrow
+from .middleware import brotli, CompressionMiddleware, ReplicaMiddleware
+from .models import (Quiz, QuizQuestion, Question, QuestionVersion, Tracker,
+                     Answer, TrackerArchive, AnswerArchive, ExportJob,
+                     HookEvent)
+from .renderers import FastJSONRenderer
+from .routers import (ReplicaRouter, allow_replicas, read_from_replicas,
+                      replicas_allowed)
+from .serializers import (QuizSerializer, QuestionSerializer,
+                          TrackerSerializer, AnswerSerializer)
+from .tasks import (ArchiveTrackers, DeliverHook, ExpireTrackers,
+                    ExportAnswers, IngestAnswers, RelayHookEvents)
+from .utils import get_redis
 
 
 class APITestCase(TestCase):
@@ -16,6 +48,17 @@ class APITestCase(TestCase):
     def setUp(self):
         self.client = APIClient()
         self.adminclient = APIClient()
+        get_redis().flushdb()
+        hooks.invalidate()
+
+    def run_on_commit(self):
+        """
+        Runs the on_commit callbacks, as the transaction TestCase wraps
+        each test in never commits
+        """
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+        for _, callback in callbacks:
+            callback()
 
 
 class AuthenticatedAPITestCase(APITestCase):
@@ -105,6 +148,67 @@ class TestQuizzesApp(AuthenticatedAPITestCase):
                          "Status code on /api/token-auth was %s -should be 200"
                          % request.status_code)
 
+    def test_question_versions(self):
+        question = self.make_question()
+        self.assertEqual(question.versions.get().version, 1)
+
+        question.active = False
+        question.save()
+        self.assertEqual(question.version, 1)
+        self.assertEqual(question.versions.count(), 1)
+
+        response = self.client.patch('/api/v1/question/%s/' % question.id,
+                                     json.dumps({"question": "Who is tall?"}),
+                                     content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["version"], 2)
+        versions = QuestionVersion.objects.filter(
+            question=question).order_by('version')
+        self.assertEqual([v.question_text for v in versions],
+                         ["Who is shortest?", "Who is tall?"])
+        self.assertEqual(versions[1].created_by, self.user)
+
+    def test_question_version_read_only(self):
+        question = self.make_question()
+        response = self.client.patch('/api/v1/question/%s/' % question.id,
+                                     json.dumps({"version": 5}),
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["version"], 1)
+
+        response = self.client.post('/api/v1/answer/', json.dumps({
+            "question": str(question.id),
+            "answer_value": "george",
+            "answer_text": "George",
+            "answer_correct": True,
+            "response_sent": "Correct!",
+            "tracker": str(self.make_tracker().id)
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # saves that set the version themselves still get a snapshot
+        question.version = 7
+        question.save()
+        self.assertEqual(question.versions.order_by('-version')[0].version,
+                         7)
+
+    def test_answer_references_question_version(self):
+        question = self.make_question()
+        answer = self.make_answer(self.make_tracker(), question)
+        question.question = "Who is tall?"
+        question.save()
+        answer2 = self.make_answer(self.make_tracker(), question)
+
+        self.assertEqual(answer.question_version.version, 1)
+        self.assertEqual(answer2.question_version.version, 2)
+
+        response = self.client.get('/api/v1/answer/%s/' % answer.id)
+
+        self.assertEqual(response.data["question_text"], "Who is shortest?")
+        self.assertEqual(response.data["question_version"],
+                         answer.question_version_id)
+
     def test_create_quiz_model_data(self):
         post_data = {
             "description": "A wonderful quiz",
@@ -285,6 +389,137 @@ class TestQuizzesApp(AuthenticatedAPITestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]["description"], "A wonderful quiz 2")
 
+    def test_quiz_questions_in_order(self):
+        questions = [str(self.make_question().id) for _ in range(3)]
+        order = [questions[2], questions[0], questions[1]]
+        response = self.client.post('/api/v1/quiz/', json.dumps({
+            "description": "An ordered quiz", "questions": order}),
+            content_type='application/json')
+        quiz = response.data["id"]
+        self.assertEqual(response.json()["questions"], order)
+
+        detail = self.client.get('/api/v1/quiz/%s/' % quiz)
+        listing = self.client.get('/api/v1/quiz/')
+
+        self.assertEqual(detail.json()["questions"], order)
+        self.assertEqual(listing.json()["results"][0]["questions"], order)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/quiz/%s/questions/2/' % quiz)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["id"], questions[0])
+        self.assertEqual(response.data["position"], 2)
+        # one lookup, without loading the quiz
+        self.assertEqual(len([q for q in queries
+                              if 'quizzes_quiz' in q['sql']]), 1)
+        response = self.client.get('/api/v1/quiz/%s/questions/4/' % quiz)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        sparse = self.client.get('/api/v1/quiz/%s/' % quiz,
+                                 {"fields": "id,questions"})
+        self.assertEqual(sparse.json()["questions"], order)
+        self.make_quiz().set_questions(questions)
+        with CaptureQueriesContext(connection) as queries:
+            sparse = self.client.get('/api/v1/quiz/', {"fields": "questions"})
+        self.assertEqual(sparse.json()["results"][0]["questions"], order)
+        # the questions of every quiz in one query
+        self.assertEqual(len([q for q in queries
+                              if 'quizzes_quiz_questions' in q['sql']]), 1)
+
+        response = self.client.patch(
+            '/api/v1/quiz/%s/' % quiz,
+            json.dumps({"questions": questions[::-1]}),
+            content_type='application/json')
+        self.assertEqual(response.json()["questions"], questions[::-1])
+
+    def test_reorder_quiz_questions(self):
+        questions = [str(self.make_question().id) for _ in range(3)]
+        response = self.client.post('/api/v1/quiz/', json.dumps({
+            "description": "An ordered quiz", "questions": questions}),
+            content_type='application/json')
+        quiz = response.data["id"]
+
+        response = self.client.put(
+            '/api/v1/quiz/%s/questions/' % quiz,
+            json.dumps({"questions": questions[::-1]}),
+            content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        detail = self.client.get('/api/v1/quiz/%s/' % quiz)
+        self.assertEqual(detail.json()["questions"], questions[::-1])
+        response = self.client.get('/api/v1/quiz/%s/questions/1/' % quiz)
+        self.assertEqual(response.data["id"], questions[2])
+
+        # every question, once
+        for order in (questions[:2], questions + questions[:1]):
+            response = self.client.put(
+                '/api/v1/quiz/%s/questions/' % quiz,
+                json.dumps({"questions": order}),
+                content_type='application/json')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+        detail = self.client.get('/api/v1/quiz/%s/' % quiz)
+        self.assertEqual(detail.json()["questions"], questions[::-1])
+
+    def test_quiz_question_at_after_delete(self):
+        questions = [self.make_question() for _ in range(3)]
+        quiz = self.make_quiz()
+        quiz.set_questions(questions)
+        questions[1].delete()
+
+        response = self.client.get('/api/v1/quiz/%s/questions/2/' % quiz.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["id"], str(questions[2].id))
+        self.assertEqual(response.data["position"], 2)
+        for position in (0, 3):
+            response = self.client.get(
+                '/api/v1/quiz/%s/questions/%s/' % (quiz.id, position))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_filter_quiz_metadata(self):
+        sms = self.make_quiz(quiz_data={
+            "description": "SMS quiz",
+            "metadata": {"campaign": {"name": "moms", "lang": "en"}, "b": 2}
+        })
+        self.make_quiz(quiz_data={
+            "description": "USSD quiz",
+            "metadata": {"campaign": {"name": "moms", "lang": "zu"}, "b": 2}
+        })
+
+        response = self.client.get('/api/v1/quiz/', {
+            "metadata__contains": json.dumps({"b": 2}),
+            "metadata__campaign__lang": "en"
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()["results"]
+        self.assertEqual([r["id"] for r in results], [str(sms.id)])
+
+        response = self.client.get('/api/v1/quiz/', {"metadata__b": "2"})
+        self.assertEqual(len(response.json()["results"]), 2)
+
+        response = self.client.get('/api/v1/quiz/', {"metadata__b": '"2"'})
+        self.assertEqual(len(response.json()["results"]), 0)
+
+    def test_filter_quiz_metadata_bad_json(self):
+        response = self.client.get('/api/v1/quiz/',
+                                   {"metadata__contains": "{nope"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_tracker_metadata(self):
+        tracker = self.make_tracker()
+        tracker.metadata = {"channel": "sms"}
+        tracker.save()
+        self.make_tracker()
+
+        response = self.client.get('/api/v1/tracker/',
+                                   {"metadata__channel": "sms"})
+
+        results = response.json()["results"]
+        self.assertEqual([r["id"] for r in results], [str(tracker.id)])
+
     def test_create_tracker_model_data(self):
         quiz = self.make_quiz()
         post_data = {
@@ -335,11 +570,75 @@ class TestQuizzesApp(AuthenticatedAPITestCase):
         self.assertEqual(d.complete, True)
         self.assertIsNotNone(d.completed_at)
 
+    def test_create_duplicate_incomplete_tracker(self):
+        tracker = self.make_tracker()
+        post_data = {
+            "identity": str(tracker.identity),
+            "quiz": str(tracker.quiz_id)
+        }
+        response = self.client.post('/api/v1/tracker/',
+                                    json.dumps(post_data),
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tracker.objects.count(), 1)
+
+    def test_reopen_tracker_with_incomplete_tracker(self):
+        tracker = self.make_tracker()
+        Tracker.objects.filter(id=tracker.id).update(complete=True)
+        self.make_tracker({"identity": tracker.identity,
+                           "quiz": tracker.quiz})
+
+        response = self.client.patch('/api/v1/tracker/%s/' % tracker.id,
+                                     json.dumps({"complete": False}),
+                                     content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        tracker.refresh_from_db()
+        self.assertTrue(tracker.complete)
+
+    def test_get_or_create_tracker(self):
+        quiz = self.make_quiz()
+        post_data = {
+            "identity": "b45d17b6-1291-4825-bfb9-446f6f853dae",
+            "quiz": str(quiz.id),
+            "metadata": {"channel": "sms"}
+        }
+        response = self.client.post('/api/v1/tracker/get-or-create/',
+                                    json.dumps(post_data),
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        d = Tracker.objects.get()
+        self.assertEqual(response.data["id"], str(d.id))
+        self.assertEqual(d.metadata, {"channel": "sms"})
+        self.assertEqual(d.created_by, self.user)
+        self.assertIsNotNone(d.started_at)
+
+        # retries return the same tracker
+        response = self.client.post('/api/v1/tracker/get-or-create/',
+                                    json.dumps(post_data),
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["id"], str(d.id))
+        self.assertEqual(Tracker.objects.count(), 1)
+
+        # once complete, a new attempt gets a new tracker
+        Tracker.objects.update(complete=True)
+        response = self.client.post('/api/v1/tracker/get-or-create/',
+                                    json.dumps(post_data),
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(response.data["id"], str(d.id))
+        self.assertEqual(Tracker.objects.count(), 2)
+
     def test_create_answer_model_data_correct(self):
         # create question, quiz and tracker
         question = self.make_question()
         quiz = self.make_quiz()
-        quiz.questions = [question]
+        quiz.set_questions([question])
         quiz.save()
         tracker = self.make_tracker(tracker_data={
             "identity": "b45d17b6-1291-4825-bfb9-446f6f853dae",
@@ -376,7 +675,7 @@ class TestQuizzesApp(AuthenticatedAPITestCase):
         # create question, quiz and tracker
         question = self.make_question()
         quiz = self.make_quiz()
-        quiz.questions = [question]
+        quiz.set_questions([question])
         quiz.save()
         tracker = self.make_tracker(tracker_data={
             "identity": "b45d17b6-1291-4825-bfb9-446f6f853dae",
@@ -410,10 +709,274 @@ class TestQuizzesApp(AuthenticatedAPITestCase):
         self.assertIsNotNone(d.created_at)
         self.assertEqual(d.created_by, self.user)
 
-    def test_get_quizzes_untaken(self):
+    @override_settings(ANSWER_INGESTION='queued')
+    def test_create_answer_queued(self):
         question = self.make_question()
         quiz = self.make_quiz()
-        quiz.questions = [question]
+        trackers = [self.make_tracker(tracker_data={
+            "identity": str(uuid.UUID(int=n)), "quiz": quiz})
+            for n in (1, 2)]
+        post_data = {
+            "question": str(question.id),
+            "answer_value": "george",
+            "answer_text": "George",
+            "answer_correct": True,
+            "response_sent": "Correct! That's why his desk is so low!",
+        }
+        # another drain is running, so answers wait in the queue
+        get_redis().set(ingestion.LOCK_KEY, "other")
+        ids = []
+        for tracker in trackers + trackers[:1]:
+            response = self.client.post(
+                '/api/v1/answer/',
+                json.dumps(dict(post_data, tracker=str(tracker.id))),
+                content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            ids.append(response.data["id"])
+        response = self.client.post(
+            '/api/v1/answer/',
+            json.dumps(dict(post_data, tracker=str(uuid.uuid4()))),
+            content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(Answer.objects.exists())
+
+        get_redis().delete(ingestion.LOCK_KEY)
+        with CaptureQueriesContext(connection) as queries:
+            drained = IngestAnswers.apply(kwargs={"batch_size": 2}).get()
+
+        self.assertEqual(drained, 4)
+        self.assertEqual(ingestion.queued(), 0)
+        # the answer to a tracker that doesn't exist is dropped
+        self.assertEqual(sorted(str(pk) for pk in Answer.objects.values_list(
+            'id', flat=True)), sorted(ids))
+        answer = Answer.objects.get(id=ids[0])
+        self.assertEqual(answer.question_text, "Who is shortest?")
+        self.assertEqual(answer.tracker, trackers[0])
+        self.assertEqual(answer.created_by, self.user)
+        # one insert per batch
+        self.assertEqual(len([q for q in queries if q['sql'].startswith(
+            'INSERT INTO "quizzes_answer"')]), 2)
+        self.assertEqual(leaderboards.rank(quiz.id, uuid.UUID(int=1)),
+                         {"identity": str(uuid.UUID(int=1)), "score": 2,
+                          "rank": 1})
+
+        # answers already written aren't written twice
+        ingestion.ingest([dict(
+            post_data, id=ids[0], question_id=str(question.id),
+            tracker_id=str(trackers[0].id), created_by=self.user.pk,
+            enqueued_at=0)])
+        self.assertEqual(Answer.objects.count(), 3)
+
+    @override_settings(ANSWER_INGEST_MAX_FAILURES=2)
+    def test_ingest_dead_letters_failing_answers(self):
+        question = self.make_question()
+        tracker = self.make_tracker()
+        answer = {
+            "question_id": str(question.id), "tracker_id": str(tracker.id),
+            "answer_value": "george", "answer_text": "George",
+            "answer_correct": True, "response_sent": "Correct!",
+            "created_by": self.user.pk, "enqueued_at": 0,
+        }
+        bad = json.dumps(dict(answer, id=str(uuid.uuid4()),
+                              question_id="not a uuid"))
+        redis = get_redis()
+        redis.lpush(ingestion.QUEUE_KEY, bad,
+                    json.dumps(dict(answer, id=str(uuid.uuid4()))))
+
+        with self.assertRaises(ValueError):
+            ingestion.drain(10)
+        self.assertEqual(ingestion.queued(), 2)
+
+        # the next failure sets the bad answer aside
+        self.assertEqual(ingestion.drain(10), 2)
+        self.assertEqual(ingestion.queued(), 0)
+        self.assertEqual(Answer.objects.count(), 1)
+        self.assertEqual(redis.lrange(ingestion.DEAD_KEY, 0, -1),
+                         [bad.encode('utf-8')])
+
+    def test_ingest_lost_lock(self):
+        redis = get_redis()
+        redis.lpush(ingestion.QUEUE_KEY, "a", "b", "c")
+        redis.set(ingestion.LOCK_KEY, "other")
+
+        # a drain whose lock lapsed to another leaves the queue alone
+        self.assertFalse(ingestion.trim(redis, "mine", 2))
+        self.assertEqual(ingestion.queued(), 3)
+        self.assertEqual(redis.ttl(ingestion.LOCK_KEY), -1)
+
+        redis.set(ingestion.LOCK_KEY, "mine")
+        self.assertTrue(ingestion.trim(redis, "mine", 2))
+        self.assertEqual(redis.lrange(ingestion.QUEUE_KEY, 0, -1), [b"c"])
+        self.assertTrue(redis.ttl(ingestion.LOCK_KEY) > 0)
+
+    @override_settings(ANSWER_INGESTION='queued', ANSWER_QUEUE_MAX_LENGTH=1)
+    def test_create_answer_queue_full(self):
+        get_redis().lpush(ingestion.QUEUE_KEY, "{}")
+        response = self.client.post('/api/v1/answer/', json.dumps({
+            "question": str(uuid.uuid4()),
+            "answer_value": "george",
+            "answer_text": "George",
+            "response_sent": "Correct!",
+            "tracker": str(uuid.uuid4()),
+        }), content_type='application/json')
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(ingestion.queued(), 1)
+
+    def test_create_answer_idempotency_key(self):
+        question = self.make_question()
+        tracker = self.make_tracker()
+        post_data = {
+            "question": str(question.id),
+            "answer_value": "george",
+            "answer_text": "George",
+            "answer_correct": True,
+            "response_sent": "Correct! That's why his desk is so low!",
+            "tracker": str(tracker.id)
+        }
+        response = self.client.post('/api/v1/answer/',
+                                    json.dumps(post_data),
+                                    content_type='application/json',
+                                    HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # a retry replays the stored response
+        retry = self.client.post('/api/v1/answer/',
+                                 json.dumps(post_data),
+                                 content_type='application/json',
+                                 HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), response.json())
+        self.assertEqual(Answer.objects.count(), 1)
+
+        # reusing the key for another answer is refused
+        post_data["answer_value"] = "fred"
+        retry = self.client.post('/api/v1/answer/',
+                                 json.dumps(post_data),
+                                 content_type='application/json',
+                                 HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(retry.status_code, 422)
+        self.assertEqual(Answer.objects.count(), 1)
+        post_data["answer_value"] = "george"
+
+        # the same key from another client is not replayed
+        response = self.adminclient.post('/api/v1/answer/',
+                                         json.dumps(post_data),
+                                         content_type='application/json',
+                                         HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(Answer.objects.count(), 2)
+
+    def test_idempotency_key_clients(self):
+        redis = get_redis()
+        anonymous = Client()
+        response = anonymous.post('/api/v1/quiz/', '{}',
+                                  content_type='application/json',
+                                  HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        # clients without credentials or a session aren't told apart
+        self.assertEqual(redis.keys('idempotency:*'), [])
+
+        anonymous.cookies[settings.SESSION_COOKIE_NAME] = 'session-a'
+        anonymous.post('/api/v1/quiz/', '{}',
+                       content_type='application/json',
+                       HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(len(redis.keys('idempotency:*')), 1)
+
+        # another session's key is its own
+        other = Client()
+        other.cookies[settings.SESSION_COOKIE_NAME] = 'session-b'
+        response = other.post('/api/v1/quiz/', '{}',
+                              content_type='application/json',
+                              HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(len(redis.keys('idempotency:*')), 2)
+
+    def test_idempotency_key_in_progress(self):
+        tracker = self.make_tracker()
+        patch_data = {"complete": True}
+        self.client.patch('/api/v1/tracker/%s/' % tracker.id,
+                          json.dumps(patch_data),
+                          content_type='application/json',
+                          HTTP_IDEMPOTENCY_KEY='abc')
+        redis = get_redis()
+        key, = redis.keys('idempotency:*')
+        redis.set(key, 'in-progress')
+
+        response = self.client.patch('/api/v1/tracker/%s/' % tracker.id,
+                                     json.dumps(patch_data),
+                                     content_type='application/json',
+                                     HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    @override_settings(THROTTLE_RATES={'identity:quiz-untaken': '2/min'})
+    def test_throttle_identity(self):
+        identity = "b45d17b6-1291-4825-bfb9-446f6f853dae"
+        for _ in range(2):
+            response = self.client.get('/api/v1/quiz/untaken',
+                                       {"identity": identity})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/quiz/untaken',
+                                       {"identity": identity})
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertTrue(0 < int(response['Retry-After']) <= 60)
+        # just the token lookup
+        self.assertEqual(len(queries), 1)
+
+        # other learners and endpoints are unaffected
+        response = self.client.get('/api/v1/quiz/untaken', {
+            "identity": "c45d17b6-1291-4825-bfb9-446f6f853dae"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/api/v1/tracker/',
+                                   {"identity": identity})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(THROTTLE_RATES={'identity:quiz-untaken': '2/min'})
+    def test_throttle_identity_unauthenticated(self):
+        identity = "b45d17b6-1291-4825-bfb9-446f6f853dae"
+        anonymous = APIClient()
+        for _ in range(3):
+            response = anonymous.get('/api/v1/quiz/untaken',
+                                     {"identity": identity})
+            self.assertEqual(response.status_code,
+                             status.HTTP_401_UNAUTHORIZED)
+
+        # the learner's requests aren't used up
+        response = self.client.get('/api/v1/quiz/untaken',
+                                   {"identity": identity})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(THROTTLE_RATES={'token': '1/min'})
+    def test_throttle_token(self):
+        response = self.client.get('/api/v1/quiz/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post('/api/v1/quiz/', json.dumps({
+            "description": "A quiz", "questions": []}),
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+        # throttled requests aren't replayed to retries
+        self.assertEqual(get_redis().keys('idempotency:*'), [])
+        response = self.adminclient.get('/api/v1/quiz/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_quizzes_untaken(self):
+        question = self.make_question()
+        quiz = self.make_quiz(quiz_data={
+            "description": "A wonderful quiz", "active": True})
+        quiz.set_questions([question])
         quiz.save()
         self.make_tracker(tracker_data={
             "identity": "b45d17b6-1291-4825-bfb9-446f6f853dae",
@@ -429,7 +992,7 @@ class TestQuizzesApp(AuthenticatedAPITestCase):
             "metadata": {'a': 'a', 'b': 2}
         }
         quiz2 = self.make_quiz(quiz_data=quiz2_data)
-        quiz2.questions = [question2]
+        quiz2.set_questions([question2])
         quiz2.save()
         notdone = str(quiz2.id)
 
@@ -444,6 +1007,730 @@ class TestQuizzesApp(AuthenticatedAPITestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]["id"], notdone)
 
+        # quizzes taken long ago, on archived trackers, are still taken
+        Tracker.objects.update(
+            started_at=timezone.now() - timedelta(days=400))
+        ArchiveTrackers.apply(kwargs={"days": 365})
+        self.assertFalse(Tracker.objects.exists())
+        response = self.client.get('/api/v1/quiz/untaken', {
+            "identity": "b45d17b6-1291-4825-bfb9-446f6f853dae"})
+        self.assertEqual([quiz["id"] for quiz in response.json()["results"]],
+                         [notdone])
+
+    def make_answer(self, tracker, question):
+        return Answer.objects.create(
+            tracker=tracker, question=question, answer_value="george",
+            answer_text="George", answer_correct=True,
+            response_sent=question.response_correct)
+
+    def test_archive_trackers(self):
+        question = self.make_question()
+        old = self.make_tracker()
+        self.make_answer(old, question)
+        open_ = self.make_tracker()
+        Tracker.objects.filter(id=old.id).update(complete=True)
+        Tracker.objects.update(
+            started_at=timezone.now() - timedelta(days=400))
+        recent = self.make_tracker()
+        Tracker.objects.filter(id=recent.id).update(complete=True)
+        self.make_answer(recent, question)
+
+        moved = ArchiveTrackers.apply(kwargs={"days": 365}).get()
+
+        self.assertEqual(moved, 1)
+        # open trackers can still be answered
+        self.assertEqual(set(Tracker.objects.all()), set([open_, recent]))
+        self.make_answer(open_, question)
+        self.assertEqual(Answer.objects.filter(tracker=recent).count(), 1)
+        archived = TrackerArchive.objects.get()
+        self.assertEqual(archived.id, old.id)
+        self.assertEqual(archived.quiz, old.quiz)
+        self.assertEqual(AnswerArchive.objects.get().tracker, archived)
+
+    def test_expire_trackers(self):
+        question = self.make_question()
+        long_ago = timezone.now() - timedelta(hours=100)
+        idle = self.make_tracker()
+        answered_long_ago = self.make_tracker()
+        Answer.objects.filter(
+            id=self.make_answer(answered_long_ago, question).id).update(
+            created_at=long_ago)
+        answering = self.make_tracker()
+        self.make_answer(answering, question)
+        complete = self.make_tracker()
+        Tracker.objects.filter(id=complete.id).update(complete=True)
+        Tracker.objects.update(started_at=long_ago)
+        recent = self.make_tracker()
+
+        marked = ExpireTrackers.apply(
+            kwargs={"hours": 72, "batch_size": 1}).get()
+
+        self.assertEqual(marked, 2)
+        self.assertEqual(
+            set(Tracker.objects.filter(abandoned=True)),
+            set([idle, answered_long_ago]))
+        self.assertFalse(Tracker.objects.filter(
+            id__in=[answering.id, complete.id, recent.id],
+            abandoned=True).exists())
+
+        # the identity starts over instead of resuming an abandoned tracker
+        response = self.client.post(
+            '/api/v1/tracker/get-or-create/', json.dumps({
+                "identity": str(idle.identity), "quiz": str(idle.quiz_id)}),
+            content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(response.data["id"], str(idle.id))
+        self.assertFalse(response.data["abandoned"])
+
+    def make_leaderboard(self):
+        """
+        A quiz where identity 1 has three correct answers over two
+        attempts, identities 2 and 3 have one and identity 4 none
+        """
+        question = self.make_question()
+        quiz = self.make_quiz()
+        identities = [str(uuid.UUID(int=n)) for n in range(1, 5)]
+        for identity, correct in zip(identities, [2, 1, 1, 0]):
+            tracker = self.make_tracker(
+                {"identity": identity, "quiz": quiz, "complete": True})
+            for _ in range(correct):
+                self.make_answer(tracker, question)
+            Answer.objects.create(
+                tracker=tracker, question=question, answer_value="mike",
+                answer_text="Mike", answer_correct=False,
+                response_sent=question.response_incorrect)
+        self.make_answer(self.make_tracker(
+            {"identity": identities[0], "quiz": quiz}), question)
+        self.run_on_commit()
+        return quiz, identities
+
+    def test_leaderboard(self):
+        quiz, identities = self.make_leaderboard()
+
+        response = self.client.get('/api/v1/quiz/%s/leaderboard/' % quiz.id,
+                                   {"limit": 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first, second = response.data["results"]
+        self.assertEqual(first,
+                         {"identity": identities[0], "score": 3, "rank": 1})
+        # identities 2 and 3 tie for second
+        self.assertIn(second["identity"], identities[1:3])
+        self.assertEqual((second["score"], second["rank"]), (1, 2))
+
+        response = self.client.get(
+            '/api/v1/quiz/%s/leaderboard/rank/' % quiz.id,
+            {"identity": identities[2]})
+        self.assertEqual(response.data,
+                         {"identity": identities[2], "score": 1, "rank": 2})
+        response = self.client.get(
+            '/api/v1/quiz/%s/leaderboard/rank/' % quiz.id,
+            {"identity": identities[3]})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # marking an answer incorrect or deleting it takes it off
+        answer = Answer.objects.filter(
+            tracker__identity=identities[0], answer_correct=True).first()
+        response = self.client.patch('/api/v1/answer/%s/' % answer.id,
+                                     json.dumps({"answer_correct": False}),
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        Answer.objects.filter(tracker__identity=identities[1]).delete()
+        self.run_on_commit()
+
+        response = self.client.get('/api/v1/quiz/%s/leaderboard/' % quiz.id)
+        self.assertEqual(response.data["results"], [
+            {"identity": identities[0], "score": 2, "rank": 1},
+            {"identity": identities[2], "score": 1, "rank": 2},
+        ])
+
+    def test_leaderboard_bad_limit(self):
+        quiz = self.make_quiz()
+        response = self.client.get('/api/v1/quiz/%s/leaderboard/' % quiz.id,
+                                   {"limit": "all"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_leaderboard_rolled_back_answer(self):
+        question = self.make_question()
+        tracker = self.make_tracker()
+        try:
+            with transaction.atomic():
+                self.make_answer(tracker, question)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.run_on_commit()
+
+        self.assertIsNone(leaderboards.rank(tracker.quiz_id,
+                                            tracker.identity))
+
+    def test_leaderboard_redis_unavailable(self):
+        quiz = self.make_quiz()
+        utils._redis = StrictRedis(port=1)
+        try:
+            response = self.client.get(
+                '/api/v1/quiz/%s/leaderboard/' % quiz.id)
+            rank = self.client.get(
+                '/api/v1/quiz/%s/leaderboard/rank/' % quiz.id,
+                {"identity": str(uuid.uuid4())})
+        finally:
+            utils._redis = None
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(rank.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_rebuild_leaderboards(self):
+        quiz, identities = self.make_leaderboard()
+        board = self.client.get(
+            '/api/v1/quiz/%s/leaderboard/' % quiz.id).data["results"]
+        redis = get_redis()
+        redis.flushdb()
+        redis.zadd('leaderboard:%s' % uuid.uuid4(), 1, identities[0])
+
+        call_command('rebuild_leaderboards', stdout=six.StringIO())
+
+        response = self.client.get('/api/v1/quiz/%s/leaderboard/' % quiz.id)
+        self.assertEqual(response.data["results"], board)
+        self.assertEqual(redis.keys('leaderboard:*'),
+                         [('leaderboard:%s' % quiz.id).encode('utf-8')])
+
+    def test_export_started_at_window(self):
+        question = self.make_question()
+        old = self.make_tracker()
+        self.make_answer(old, question)
+        Tracker.objects.filter(id=old.id).update(
+            started_at=timezone.now() - timedelta(days=10))
+        recent = self.make_tracker()
+        self.make_answer(recent, question)
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+
+        response = self.client.get('/api/v1/tracker/export',
+                                   {"started_at__gte": since})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["tracker"], recent.id)
+        self.assertEqual(response.data[0]["question_text"],
+                         "Who is shortest?")
+
+    def test_export_archived_trackers(self):
+        question = self.make_question()
+        old = self.make_tracker()
+        self.make_answer(old, question)
+        Tracker.objects.filter(id=old.id).update(
+            started_at=timezone.now() - timedelta(days=400))
+        recent = self.make_tracker()
+        self.make_answer(recent, question)
+        ArchiveTrackers.apply(kwargs={"days": 365}).get()
+
+        response = self.client.get('/api/v1/tracker/export')
+
+        self.assertEqual([row["tracker"] for row in response.data],
+                         [old.id, recent.id])
+        self.assertEqual(response.data[0]["question_text"],
+                         "Who is shortest?")
+        job = self.client.post('/api/v1/export/', {}, format='json')
+        self.assertEqual(ExportJob.objects.get(id=job.data["id"]).rows, 2)
+        # a window after the archive cutoff leaves the archive out
+        since = timezone.now() - timedelta(days=30)
+        self.assertEqual(len(exports.export_answers(started_at__gte=since)),
+                         1)
+
+    def test_export_bad_window(self):
+        response = self.client.get('/api/v1/tracker/export',
+                                   {"started_at__gte": "yesterday"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_job(self):
+        question = self.make_question()
+        for _ in range(3):
+            tracker = self.make_tracker()
+            self.make_answer(tracker, question)
+            self.make_answer(tracker, question)
+
+        with self.settings(EXPORT_BATCH_SIZE=4):
+            response = self.client.post('/api/v1/export/', {},
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get('/api/v1/export/%s/' % response.data["id"])
+        self.assertEqual(response.data["status"], ExportJob.COMPLETE)
+        self.assertEqual(response.data["rows"], 6)
+        self.assertEqual(response.data["total"], 6)
+
+        download = self.client.get(response.data["download"])
+        self.assertEqual(download.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(download.streaming_content),
+                         self.client.get('/api/v1/tracker/export').content)
+
+    def test_export_job_quiz(self):
+        question = self.make_question()
+        tracker = self.make_tracker()
+        self.make_answer(tracker, question)
+        self.make_answer(self.make_tracker(), question)
+
+        response = self.client.post('/api/v1/export/',
+                                    {"quiz": str(tracker.quiz.id)},
+                                    format='json')
+
+        job = ExportJob.objects.get(id=response.data["id"])
+        self.assertEqual(job.rows, 1)
+        rows = job.file.read().decode('utf-8').splitlines()
+        self.assertEqual(len(rows), 2)
+        self.assertIn(str(tracker.id), rows[1])
+
+    def test_export_job_ndjson(self):
+        question = self.make_question()
+        tracker = self.make_tracker()
+        answer = self.make_answer(tracker, question)
+
+        response = self.client.post('/api/v1/export/', {"format": "ndjson"},
+                                    format='json')
+
+        download = self.client.get('/api/v1/export/%s/download/' %
+                                   response.data["id"])
+        self.assertEqual(download['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(download.streaming_content).splitlines()
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0].decode('utf-8'))
+        self.assertEqual(row["tracker"], str(tracker.id))
+        self.assertIs(row["answer_correct"], answer.answer_correct)
+        self.assertEqual(row["question_text"], "Who is shortest?")
+        self.assertEqual(
+            row["answer_created_at"],
+            serializers.DateTimeField().to_representation(answer.created_at))
+
+    @skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_export_job_parquet(self):
+        question = self.make_question()
+        tracker = self.make_tracker()
+        for _ in range(3):
+            answer = self.make_answer(tracker, question)
+
+        with self.settings(EXPORT_BATCH_SIZE=2):
+            response = self.client.post('/api/v1/export/',
+                                        {"format": "parquet"}, format='json')
+
+        job = ExportJob.objects.get(id=response.data["id"])
+        parquet = pyarrow.parquet.ParquetFile(job.file)
+        self.assertEqual(parquet.num_row_groups, 2)
+        table = parquet.read()
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(table.column("identity")[0].as_py(),
+                         str(tracker.identity))
+        self.assertIs(table.column("answer_correct")[0].as_py(),
+                      answer.answer_correct)
+        self.assertEqual(table.column("answer_created_at")[2].as_py(),
+                         answer.created_at)
+
+    @override_settings(REPLICA_DATABASES=['missing'])
+    def test_export_job_failed_count(self):
+        job = ExportJob.objects.create()
+
+        with self.assertRaises(ConnectionDoesNotExist):
+            ExportAnswers().run(str(job.id))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.FAILED)
+        self.assertIsNotNone(job.completed_at)
+
+    def test_export_job_download_pending(self):
+        job = ExportJob.objects.create()
+
+        response = self.client.get('/api/v1/export/%s/download/' % job.id)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIsNone(self.client.get(
+            '/api/v1/export/%s/' % job.id).data["download"])
+
+    def test_admin_answer_changelist(self):
+        question = self.make_question()
+        answer = self.make_answer(self.make_tracker(), question)
+        self.make_answer(self.make_tracker(), self.make_question())
+        client = Client()
+        client.login(username=self.adminusername,
+                     password=self.adminpassword)
+
+        response = client.get('/admin/quizzes/answer/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+        response = client.get('/admin/quizzes/answer/',
+                              {"question": str(question.id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['cl'].result_list), [answer])
+
+        response = client.get('/admin/quizzes/answer/',
+                              {"question": "not-a-uuid"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+    def test_admin_quiz_questions(self):
+        quiz = self.make_quiz()
+        first, second = self.make_question(), self.make_question()
+        quiz.set_questions([first])
+        placed = QuizQuestion.objects.get(quiz=quiz)
+        client = Client()
+        client.login(username=self.adminusername,
+                     password=self.adminpassword)
+        url = '/admin/quizzes/quiz/%s/change/' % quiz.id
+
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'quizquestion_set-0-position')
+
+        response = client.post(url, {
+            "description": quiz.description,
+            "metadata": json.dumps(quiz.metadata),
+            "created_by": self.adminuser.id,
+            "updated_by": self.adminuser.id,
+            "quizquestion_set-TOTAL_FORMS": 2,
+            "quizquestion_set-INITIAL_FORMS": 1,
+            "quizquestion_set-0-id": placed.id,
+            "quizquestion_set-0-quiz": quiz.id,
+            "quizquestion_set-0-question": first.id,
+            "quizquestion_set-0-position": 2,
+            "quizquestion_set-1-quiz": quiz.id,
+            "quizquestion_set-1-question": second.id,
+            "quizquestion_set-1-position": 1,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual([placed.question for placed in
+                          QuizQuestion.objects.filter(quiz=quiz)],
+                         [second, first])
+
+    def test_admin_estimated_count(self):
+        self.make_tracker()
+        paginator = EstimatedCountPaginator(
+            Tracker.objects.filter(complete=False), 100)
+        paginator.exact_count_limit = -1
+
+        self.assertIsInstance(paginator.count, int)
+        self.assertEqual(EstimatedCountPaginator(
+            Tracker.objects.all(), 100).count, 1)
+
+    def test_seed_and_benchmark_commands(self):
+        call_command('seed_benchmark_data', quizzes=3, questions_per_quiz=2,
+                     identities=5, trackers=20, seed=1, stdout=six.StringIO())
+
+        self.assertEqual(Quiz.objects.count(), 3)
+        self.assertEqual(Tracker.objects.count(), 20)
+        self.assertEqual(QuestionVersion.objects.count(), 6)
+        self.assertTrue(Answer.objects.exists())
+
+        out = six.StringIO()
+        call_command('benchmark', iterations=2, seed=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 11)
+        self.assertEqual(Answer.objects.filter(
+            created_by__username='benchmark').count(), 0)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics(self):
+        self.make_quiz()
+        labels = {'route': 'quiz-list'}
+        before = REGISTRY.get_sample_value(
+            'http_request_db_queries_sum', labels) or 0
+
+        # queries are counted with queries being logged too
+        with CaptureQueriesContext(connection):
+            self.client.get('/api/v1/quiz/')
+        scraper = Client()
+        response = scraper.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds_count{method="GET",'
+                      b'route="quiz-list",status="200"}', response.content)
+        self.assertGreater(REGISTRY.get_sample_value(
+            'http_request_db_queries_sum', labels), before)
+
+        for headers in ({}, {'HTTP_AUTHORIZATION': 'Bearer wrong'},
+                        {'HTTP_AUTHORIZATION': 'Token %s' % self.token}):
+            response = scraper.get('/metrics', **headers)
+            self.assertEqual(response.status_code, 403)
+        with self.settings(METRICS_TOKEN=''):
+            response = scraper.get('/metrics', HTTP_AUTHORIZATION='Bearer ')
+            self.assertEqual(response.status_code, 403)
+
+    @responses.activate
+    def test_hook_delivery_metrics(self):
+        responses.add(responses.POST, "http://example.com/hook/", status=503)
+        labels = {'outcome': '5xx'}
+        before = REGISTRY.get_sample_value(
+            'hook_delivery_duration_seconds_count', labels) or 0
+
+        DeliverHook().run("http://example.com/hook/", {"data": {}})
+
+        self.assertEqual(REGISTRY.get_sample_value(
+            'hook_delivery_duration_seconds_count', labels), before + 1)
+
+    @responses.activate
+    @override_settings(HOOK_CIRCUIT_FAILURES=2, HOOK_DEFER_RETRIES=1)
+    def test_hook_circuit_breaker(self):
+        target = "http://example.com/hook/"
+        for status_code in (503, 503, 503, 200):
+            responses.add(responses.POST, target, status=status_code)
+        responses.add(responses.POST, "http://example.org/hook/")
+        redis = get_redis()
+
+        def deliver(url=target):
+            DeliverHook.apply(kwargs={"target": url, "payload": {}})
+
+        deliver()
+        deliver()
+        self.assertEqual(len(responses.calls), 2)
+
+        # the circuit is open, deliveries to the target are put back
+        with self.assertRaises(Retry):
+            deliver()
+        self.assertEqual(len(responses.calls), 2)
+        deliver("http://example.org/hook/")
+        self.assertEqual(len(responses.calls), 3)
+
+        # once it resets a failed probe opens it again
+        open_key, = redis.keys('circuit:*:open')
+        redis.delete(open_key)
+        deliver()
+        with self.assertRaises(Retry):
+            deliver()
+        self.assertEqual(len(responses.calls), 4)
+        self.assertTrue(redis.exists(open_key))
+
+        # and a successful one closes it
+        redis.delete(open_key)
+        deliver()
+        self.assertEqual(redis.keys('circuit:*'), [])
+        self.assertEqual(responses.calls[4].response.status_code, 200)
+
+    def test_fast_json_renderer_output(self):
+        tracker = self.make_tracker()
+        question = self.make_question()
+        tracker.quiz.set_questions([question])
+        self.make_answer(tracker, question)
+        self.make_answer(tracker, question)
+
+        for url in ['/api/v1/quiz/', '/api/v1/question/', '/api/v1/tracker/',
+                    '/api/v1/answer/', '/api/v1/quiz/%s/' % tracker.quiz.id]:
+            response = self.client.get(url)
+            self.assertIsInstance(response.accepted_renderer,
+                                  FastJSONRenderer)
+            self.assertEqual(response.content,
+                             JSONRenderer().render(response.data))
+
+    def test_fast_json_encoder(self):
+        class SubUUID(uuid.UUID):
+            pass
+
+        value = uuid.uuid4()
+        data = {
+            "uuids": [value, value, SubUUID(str(value))],
+            "datetimes": [timezone.now(), datetime(2016, 1, 1, 10, 0, 0),
+                          datetime(2016, 1, 1, 10, 0, 0, 1234)],
+            "date": datetime(2016, 1, 1).date(),
+            "time": datetime(2016, 1, 1, 10, 0, 0, 1234).time(),
+            "duration": timedelta(seconds=90),
+            "decimal": Decimal('1.10'),
+            "lazy": ugettext_lazy("Lazy"),
+            "unicode": "\u00e9\u2028",
+        }
+
+        self.assertEqual(FastJSONRenderer().render(data),
+                         JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'))
+
+    def test_values_list_matches_serializers(self):
+        tracker = self.make_tracker()
+        tracker.metadata = {"source": "sms"}
+        tracker.save()
+        question = self.make_question()
+        tracker.quiz.set_questions([question])
+        self.make_quiz()
+        Quiz.objects.update(active=True)
+        self.make_answer(tracker, question)
+
+        for url, queryset, serializer_class in [
+                ('/api/v1/quiz/', Quiz.objects.all(), QuizSerializer),
+                ('/api/v1/question/', Question.objects.all(),
+                 QuestionSerializer),
+                ('/api/v1/tracker/', Tracker.objects.all(),
+                 TrackerSerializer),
+                ('/api/v1/answer/', Answer.objects.all(), AnswerSerializer)]:
+            response = self.client.get(url)
+            expected = serializer_class(queryset, many=True).data
+            self.assertEqual(
+                sorted(response.data["results"], key=lambda d: d["id"]),
+                sorted(expected, key=lambda d: d["id"]))
+
+        response = self.client.get('/api/v1/quiz/untaken',
+                                   {"identity": str(uuid.uuid4())})
+        self.assertEqual(
+            sorted(response.data["results"], key=lambda d: d["id"]),
+            sorted(QuizSerializer(Quiz.objects.all(), many=True).data,
+                   key=lambda d: d["id"]))
+
+    def test_sparse_fields(self):
+        tracker = self.make_tracker()
+        question = self.make_question()
+        tracker.quiz.set_questions([question])
+        self.make_answer(tracker, question)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/question/',
+                                       {"fields": "id,question"})
+        self.assertEqual(list(response.data["results"][0]),
+                         ["id", "question"])
+        self.assertNotIn('"answers"', queries[-1]['sql'])
+
+        response = self.client.get('/api/v1/tracker/%s/' % tracker.id,
+                                   {"fields": "id,complete"})
+        self.assertEqual(response.data,
+                         {"id": str(tracker.id), "complete": False})
+
+        response = self.client.get('/api/v1/answer/',
+                                   {"fields": "id,question_text"})
+        self.assertEqual(response.data["results"][0]["question_text"],
+                         "Who is shortest?")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/quiz/%s/' % tracker.quiz.id,
+                                       {"omit": "questions,metadata"})
+        self.assertNotIn("questions", response.data)
+        self.assertIn("description", response.data)
+        self.assertFalse([q for q in queries
+                          if 'quizzes_quiz_questions' in q['sql']])
+
+    def test_sparse_fields_unknown(self):
+        response = self.client.get('/api/v1/question/',
+                                   {"fields": "id,nope"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_response_compression(self):
+        for _ in range(20):
+            self.make_quiz()
+
+        response = self.client.get('/api/v1/quiz/',
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept, Accept-Encoding')
+        content = gzip.GzipFile(fileobj=six.BytesIO(response.content)).read()
+        self.assertEqual(json.loads(content.decode('utf-8'))["count"], 20)
+
+        response = self.client.get('/api/v1/quiz/',
+                                   HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        response = self.client.get('/api/v1/quiz/', {"limit": 1},
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_response_compression_streaming(self):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        rows = [('%s,row\n' % i).encode('utf-8') for i in range(3)]
+        response = CompressionMiddleware().process_response(
+            request, StreamingHttpResponse(iter(rows)))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        # Each row can be decompressed as soon as its chunk arrives
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = iter(response.streaming_content)
+        for row in rows:
+            self.assertEqual(decompressor.decompress(next(chunks)), row)
+        decompressor.decompress(b''.join(chunks))
+        self.assertTrue(decompressor.eof)
+
+        # already compressed downloads are sent as they are
+        response = CompressionMiddleware().process_response(
+            request, StreamingHttpResponse(
+                iter(rows), content_type='application/octet-stream'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), b''.join(rows))
+
+    @skipIf(brotli is None, "brotli is not installed")
+    def test_response_compression_brotli(self):
+        for _ in range(20):
+            self.make_quiz()
+
+        response = self.client.get('/api/v1/quiz/',
+                                   HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        content = brotli.decompress(response.content)
+        self.assertEqual(json.loads(content.decode('utf-8'))["count"], 20)
+
+    @override_settings(REPLICA_DATABASES=['replica0'])
+    def test_replica_router(self):
+        router = ReplicaRouter()
+
+        self.assertIsNone(router.db_for_read(Quiz))
+        with read_from_replicas():
+            self.assertEqual(router.db_for_read(Quiz), 'replica0')
+            self.assertEqual(router.db_for_write(Quiz), 'default')
+        self.assertIsNone(router.db_for_read(Quiz))
+
+    @override_settings(REPLICA_DATABASES=['replica0'])
+    def test_replica_read_your_writes(self):
+        factory = RequestFactory()
+        middleware = ReplicaMiddleware()
+        token = 'Token %s' % self.token
+
+        middleware.process_request(
+            factory.get('/api/v1/quiz/', HTTP_AUTHORIZATION=token))
+        self.assertTrue(replicas_allowed())
+
+        request = factory.post('/api/v1/quiz/', HTTP_AUTHORIZATION=token)
+        middleware.process_request(request)
+        self.assertFalse(replicas_allowed())
+        middleware.process_response(request, HttpResponse(status=201))
+
+        # the writer reads from the primary until the replicas catch up
+        middleware.process_request(
+            factory.get('/api/v1/quiz/', HTTP_AUTHORIZATION=token))
+        self.assertFalse(replicas_allowed())
+        request = factory.get('/api/v1/quiz/',
+                              HTTP_AUTHORIZATION='Token other')
+        middleware.process_request(request)
+        self.assertTrue(replicas_allowed())
+        middleware.process_response(request, HttpResponse())
+        self.assertFalse(replicas_allowed())
+
+        # failed writes don't pin
+        request = factory.post('/api/v1/quiz/',
+                               HTTP_AUTHORIZATION='Token other')
+        middleware.process_request(request)
+        middleware.process_response(request, HttpResponse(status=400))
+        middleware.process_request(
+            factory.get('/api/v1/quiz/', HTTP_AUTHORIZATION='Token other'))
+        self.assertTrue(replicas_allowed())
+        allow_replicas(False)
+
+    @override_settings(REPLICA_DATABASES=['replica0'])
+    def test_replica_pins_new_session(self):
+        factory = RequestFactory()
+        middleware = ReplicaMiddleware()
+        cookie = settings.SESSION_COOKIE_NAME
+
+        # logging in replaces the session
+        request = factory.post('/admin/login/')
+        request.COOKIES[cookie] = 'old'
+        middleware.process_request(request)
+        response = HttpResponse(status=302)
+        response.set_cookie(cookie, 'new')
+        middleware.process_response(request, response)
+
+        request = factory.get('/admin/')
+        request.COOKIES[cookie] = 'new'
+        middleware.process_request(request)
+        self.assertFalse(replicas_allowed())
+        # clients without credentials or a session share no pin
+        middleware.process_request(factory.get('/admin/'))
+        self.assertTrue(replicas_allowed())
+        allow_replicas(False)
+
     def test_create_webhook(self):
         # Setup
         user = User.objects.get(username='testadminuser')
@@ -461,6 +1748,103 @@ class TestQuizzesApp(AuthenticatedAPITestCase):
         self.assertEqual(d.target, 'http://example.com/registration/')
         self.assertEqual(d.user, user)
 
+    @responses.activate
+    def test_webhook_fires_from_cached_hooks(self):
+        target = "http://example.com/registration/"
+        responses.add(responses.POST, target)
+        response = self.adminclient.post('/api/v1/webhook/', json.dumps({
+            "target": target, "event": "quiz.created"}),
+            content_type='application/json')
+        hook_id = response.data["id"]
+
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.adminclient.post(
+                    '/api/v1/quiz/', json.dumps({"description": "A quiz"}),
+                    content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # the hooks were loaded once, by the first save
+        self.assertFalse(any('rest_hooks_hook' in query['sql']
+                             for query in queries))
+        # deliveries wait in the outbox for the relay
+        self.assertEqual(len(responses.calls), 0)
+        self.assertEqual(HookEvent.objects.count(), 2)
+        call_command('relay_hook_events', once=True, stdout=six.StringIO())
+        self.assertEqual(len(responses.calls), 2)
+        self.assertFalse(HookEvent.objects.exists())
+        payload = json.loads(responses.calls[1].request.body)
+        self.assertEqual(payload["hook"]["event"], "quiz.created")
+        self.assertEqual(payload["data"]["id"], response.data["id"])
+
+        # only the hook owner's saves fire it
+        self.client.post('/api/v1/quiz/', json.dumps({"description": "B"}),
+                         content_type='application/json')
+        self.assertFalse(HookEvent.objects.exists())
+
+        # removing the hook stops it firing once the removal commits
+        self.adminclient.delete('/api/v1/webhook/%s/' % hook_id)
+        self.run_on_commit()
+        self.adminclient.post('/api/v1/quiz/',
+                              json.dumps({"description": "A quiz"}),
+                              content_type='application/json')
+        self.assertFalse(HookEvent.objects.exists())
+
+    @override_settings(HOOK_CACHE_SECONDS=0)
+    def test_hook_cache_generation(self):
+        redis = get_redis()
+        redis.delete(hooks.GENERATION_KEY)
+        hooks.hooks_for_event("quiz.created")
+
+        # a missing generation is generation 0, not a change every time
+        with CaptureQueriesContext(connection) as queries:
+            hooks.hooks_for_event("quiz.created")
+        self.assertEqual(len(queries), 0)
+
+        # the generation is bumped once the hook commits
+        Hook.objects.create(user=self.adminuser, event="quiz.created",
+                            target="http://example.com/hook/")
+        self.assertIsNone(redis.get(hooks.GENERATION_KEY))
+        self.assertEqual(hooks.hooks_for_event("quiz.created"), ())
+        self.run_on_commit()
+        self.assertEqual(hooks.generation(), 1)
+        self.assertEqual(len(hooks.hooks_for_event("quiz.created")), 1)
+
+    def test_hook_events_roll_back_with_their_change(self):
+        Hook.objects.create(user=self.user, event="question.created",
+                            target="http://example.com/hook/")
+        try:
+            with transaction.atomic():
+                self.make_question({
+                    "question_type": "freetext", "question": "Why?",
+                    "response_correct": "Yes", "response_incorrect": "No",
+                    "created_by": self.user, "updated_by": self.user})
+                self.assertEqual(HookEvent.objects.count(), 1)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+
+        self.assertFalse(HookEvent.objects.exists())
+
+    @responses.activate
+    def test_relay_hook_events_batches(self):
+        responses.add(responses.POST, "http://example.com/hook/")
+        HookEvent.objects.bulk_create([
+            HookEvent(target="http://example.com/hook/", payload={"n": n})
+            for n in range(5)])
+
+        relayed = RelayHookEvents.apply(kwargs={"batch_size": 2}).get()
+
+        self.assertEqual(relayed, 5)
+        self.assertEqual([json.loads(call.request.body)["n"]
+                          for call in responses.calls], list(range(5)))
+        self.assertFalse(HookEvent.objects.exists())
+
+    def test_routed_queues_declared(self):
+        # workers started without -Q only consume the declared queues
+        declared = set(queue.name for queue in settings.CELERY_QUEUES)
+        for task, route in settings.CELERY_ROUTES.items():
+            self.assertIn(route['queue'], declared, task)
+
     # This test is not working despite the code working fine
     # If you run these same steps below interactively the webhook will fire
     # @responses.activate
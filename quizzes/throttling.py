@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.utils import six
+from redis import RedisError
+from rest_framework.throttling import SimpleRateThrottle
+
+from .utils import get_redis, client_key
+
+
+logger = logging.getLogger(__name__)
+
+
+class RedisRateThrottle(SimpleRateThrottle):
+
+    """
+    A fixed window rate limit counted with INCR in Redis, one round trip
+    per request.
+
+    Rates are looked up in settings.THROTTLE_RATES, first for
+    '<kind>:<scope>', counted for that endpoint alone, and then for
+    '<kind>' on its own, counted across every endpoint without a rate of
+    its own. Requests with no rate are not limited. The scope is the
+    view's `throttle_scope`, followed by the action on viewsets, e.g.
+    'answer-create'. Throttles with `before_authentication` set only
+    read the request, never the database, so ThrottleFirstMixin runs them
+    before authentication. If Redis is down requests are let through.
+    """
+    kind = None
+    before_authentication = False
+    timer = time.time
+
+    def __init__(self):
+        # The rate depends on the view, so it is looked up per request
+        pass
+
+    def get_scope(self, view):
+        scope = getattr(view, 'throttle_scope', None)
+        action = getattr(view, 'action', None)
+        if scope and action:
+            return '%s-%s' % (scope, action)
+        return scope
+
+    def get_rate(self, scope):
+        """
+        Returns the rate for the scope and the name requests are counted
+        under
+        """
+        rates = settings.THROTTLE_RATES
+        name = '%s:%s' % (self.kind, scope)
+        if scope and name in rates:
+            return rates[name], name
+        return rates.get(self.kind), self.kind
+
+    def get_ident_key(self, request, view):
+        """
+        Returns the key requests are counted under, or None to not limit
+        the request. Must be overridden.
+        """
+        raise NotImplementedError('.get_ident_key() must be overridden')
+
+    def allow_request(self, request, view):
+        rate, name = self.get_rate(self.get_scope(view))
+        self.num_requests, self.duration = self.parse_rate(rate)
+        if self.num_requests is None:
+            return True
+        ident = self.get_ident_key(request, view)
+        if ident is None:
+            return True
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        key = 'throttle:%s:%s:%s' % (name, ident, window)
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.incr(key)
+            pipe.expire(key, self.duration)
+            count = pipe.execute()[0]
+        except RedisError:
+            logger.exception("Throttle store unavailable")
+            return True
+        return count <= self.num_requests
+
+    def wait(self):
+        """
+        Seconds until the current window ends
+        """
+        return self.duration - self.now % self.duration
+
+
+class TokenRateThrottle(RedisRateThrottle):
+
+    """
+    Limits each client by its credentials, or its address when it has
+    none
+    """
+    kind = 'token'
+    before_authentication = True
+
+    def get_ident_key(self, request, view):
+        if request.META.get('HTTP_AUTHORIZATION'):
+            return client_key(request)
+        return self.get_ident(request)
+
+
+class IdentityRateThrottle(RedisRateThrottle):
+
+    """
+    Limits each learner, by the identity in the query or body of the
+    request, or the tracker answers are posted to, which belongs to one
+    identity. Requests for no identity are not limited, nor are
+    unauthenticated ones, so nobody but the API's clients can use up a
+    learner's requests.
+    """
+    kind = 'identity'
+    fields = ('identity', 'tracker')
+
+    def get_ident_key(self, request, view):
+        if not request.user or not request.user.is_authenticated():
+            return None
+        data = request.query_params
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            data = request.data
+        for field in self.fields:
+            value = data.get(field) if hasattr(data, 'get') else None
+            if value:
+                return '%s:%s' % (field, hashlib.sha1(
+                    six.text_type(value).encode('utf-8')).hexdigest())
+        return None
@@ -8,15 +8,16 @@ router.register(r'question', views.QuestionViewSet)
 router.register(r'answer', views.AnswerViewSet)
 router.register(r'tracker', views.TrackerViewSet)
 router.register(r'webhook', views.HookViewSet)
+router.register(r'export', views.ExportJobViewSet)
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browseable API.
 urlpatterns = [
     url(r'^api/v1/quiz/untaken$',
-        views.QuizzesUntaken.as_view()),
+        views.QuizzesUntaken.as_view(), name='quiz-untaken'),
     url(r'^api/v1/tracker/export$',
-        views.QuizResultsCSV.as_view()),
+        views.QuizResultsCSV.as_view(), name='tracker-export'),
     url(r'^api/v1/stats$',
-        views.StatsView.as_view()),
+        views.StatsView.as_view(), name='stats'),
     url(r'^api/v1/', include(router.urls)),
 ]
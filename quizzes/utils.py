@@ -0,0 +1,31 @@
+import hashlib
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+_redis = None
+
+
+def get_redis():
+    """
+    Returns the process wide Redis client for settings.REDIS_URL
+    """
+    global _redis
+    if _redis is None:
+        client_class = import_string(settings.REDIS_CLIENT_CLASS)
+        _redis = client_class.from_url(settings.REDIS_URL)
+    return _redis
+
+
+def client_key(request):
+    """
+    Identifies the client making a request by a hash of its credentials,
+    or its session cookie if it has none, without the database lookup
+    authenticating them needs. None for clients with neither.
+    """
+    credentials = request.META.get('HTTP_AUTHORIZATION') or \
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return hashlib.sha1(credentials.encode('utf-8')).hexdigest()
@@ -1,20 +1,42 @@
-from datetime import datetime, timedelta
-from .models import Quiz, Question, Tracker, Answer
+import logging
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, PositiveIntegerField, Value, When
+from django.http import FileResponse, Http404
+from django.utils import timezone
+from .models import (Quiz, QuizQuestion, Question, Tracker, TrackerArchive,
+                     Answer, ExportJob)
 from rest_hooks.models import Hook
-from rest_framework import viewsets, generics
+from rest_framework import (viewsets, generics, mixins, serializers,
+                            status)
+from rest_framework.decorators import detail_route, list_route
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework_csv import renderers as r
+from redis import RedisError
+from . import exports, ingestion, leaderboards
+from .mixins import (IdempotentMixin, SparseFieldsMixin, ThrottleFirstMixin,
+                     ValuesListMixin)
 from .serializers import (QuizSerializer, QuestionSerializer, AnswerSerializer,
-                          TrackerSerializer, HookSerializer)
+                          TrackerSerializer, HookSerializer,
+                          ExportJobSerializer, QuizQuestionOrderSerializer,
+                          QueuedAnswerSerializer)
+from .tasks import ExportAnswers, IngestAnswers
 
 
-class HookViewSet(viewsets.ModelViewSet):
+logger = logging.getLogger(__name__)
+
+
+class HookViewSet(IdempotentMixin, ThrottleFirstMixin, SparseFieldsMixin,
+                  viewsets.ModelViewSet):
     """
     Retrieve, create, update or destroy webhooks.
     """
     permission_classes = (IsAuthenticated,)
+    throttle_scope = 'hook'
     queryset = Hook.objects.all()
     serializer_class = HookSerializer
 
@@ -22,52 +44,192 @@ class HookViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class QuizViewSet(viewsets.ModelViewSet):
+class QuizViewSet(IdempotentMixin, ThrottleFirstMixin, SparseFieldsMixin,
+                  ValuesListMixin, viewsets.ModelViewSet):
 
     """
     API endpoint that allows Quiz models to be viewed or edited.
     """
     permission_classes = (IsAuthenticated,)
-    queryset = Quiz.objects.all()
+    throttle_scope = 'quiz'
+    queryset = Quiz.objects.with_questions()
     serializer_class = QuizSerializer
     filter_fields = ('active', 'metadata', 'archived')
+    json_filter_fields = ('metadata',)
 
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user,
-                        updated_by=self.request.user)
+        # The quiz, its questions and the hook events it fires commit
+        # together
+        with transaction.atomic():
+            serializer.save(created_by=self.request.user,
+                            updated_by=self.request.user)
 
     def perform_update(self, serializer):
         serializer.save(updated_by=self.request.user)
 
+    def get_quiz_id(self, pk):
+        try:
+            return uuid.UUID(pk)
+        except ValueError:
+            raise Http404
 
-class QuestionViewSet(viewsets.ModelViewSet):
+    @detail_route(methods=['get'])
+    def leaderboard(self, request, pk=None):
+        """
+        The `limit` (default 10, at most 100) identities with the most
+        correct answers on the quiz, read from Redis without touching the
+        database, so unknown quizzes have an empty board.
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 100)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            raise serializers.ValidationError({
+                "limit": ["Must be a whole number from 1 to 100."]})
+        try:
+            board = leaderboards.top(self.get_quiz_id(pk), limit)
+        except RedisError:
+            return self.leaderboard_unavailable()
+        return Response({"results": board})
+
+    @detail_route(methods=['get'], url_path='leaderboard/rank')
+    def leaderboard_rank(self, request, pk=None):
+        """
+        The score and rank on the quiz's leaderboard of the `identity`
+        query parameter, 404 if it has no correct answers on it
+        """
+        try:
+            identity = uuid.UUID(request.query_params.get('identity', ''))
+        except ValueError:
+            raise serializers.ValidationError({
+                "identity": ["Must be a valid UUID."]})
+        try:
+            entry = leaderboards.rank(self.get_quiz_id(pk), identity)
+        except RedisError:
+            return self.leaderboard_unavailable()
+        if entry is None:
+            raise Http404
+        return Response(entry)
+
+    def leaderboard_unavailable(self):
+        logger.exception("Leaderboards unavailable")
+        return Response({"detail": "Leaderboards are unavailable."},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @detail_route(methods=['get'], url_path='questions/(?P<position>[0-9]+)')
+    def question_at(self, request, pk=None, position=None):
+        """
+        The quiz's question at `position`, numbered from 1, looked up on
+        the (quiz, position) index without loading the quiz. It is the
+        nth in position order rather than the one numbered n, as deleting
+        a question leaves a gap in the numbers.
+        """
+        position = int(position)
+        if position < 1:
+            raise Http404
+        placed = QuizQuestion.objects.select_related('question').filter(
+            quiz=self.get_quiz_id(pk)).order_by(
+            'position', 'id')[position - 1:position].first()
+        if placed is None:
+            raise Http404
+        data = QuestionSerializer(
+            placed.question, context=self.get_serializer_context()).data
+        data['position'] = position
+        return Response(data)
+
+    @detail_route(methods=['put'], url_path='questions')
+    def reorder(self, request, pk=None):
+        """
+        Renumbers the quiz's questions in the order of the `questions`
+        ids, which must list each of them once
+        """
+        quiz = self.get_object()
+        placed = QuizQuestion.objects.filter(quiz=quiz)
+        with transaction.atomic():
+            current = placed.select_for_update().values_list(
+                'question_id', flat=True)
+            serializer = QuizQuestionOrderSerializer(
+                data=request.data, context={'questions': list(current)})
+            serializer.is_valid(raise_exception=True)
+            order = serializer.validated_data['questions']
+            if order:
+                placed.update(position=Case(
+                    *[When(question_id=question_id, then=Value(position))
+                      for position, question_id in enumerate(order, 1)],
+                    output_field=PositiveIntegerField()))
+            quiz.updated_by = request.user
+            quiz.save(update_fields=['updated_by', 'updated_at'])
+        return Response(serializer.data)
+
+
+class QuestionViewSet(IdempotentMixin, ThrottleFirstMixin, SparseFieldsMixin,
+                      ValuesListMixin, viewsets.ModelViewSet):
 
     """
     API endpoint that allows Question models to be viewed or edited.
     """
     permission_classes = (IsAuthenticated,)
+    throttle_scope = 'question'
     queryset = Question.objects.all()
     serializer_class = QuestionSerializer
     filter_fields = ('question_type', 'active')
 
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user,
-                        updated_by=self.request.user)
+        # The question, its first version and the hook events it fires
+        # commit together
+        with transaction.atomic():
+            serializer.save(created_by=self.request.user,
+                            updated_by=self.request.user)
 
     def perform_update(self, serializer):
         serializer.save(updated_by=self.request.user)
 
 
-class AnswerViewSet(viewsets.ModelViewSet):
+class AnswerViewSet(IdempotentMixin, ThrottleFirstMixin, SparseFieldsMixin,
+                    ValuesListMixin, viewsets.ModelViewSet):
 
     """
     API endpoint that allows Answer models to be viewed or edited.
     """
     permission_classes = (IsAuthenticated,)
-    queryset = Answer.objects.all()
+    throttle_scope = 'answer'
+    queryset = Answer.objects.select_related('question_version')
     serializer_class = AnswerSerializer
     filter_fields = ('question', 'tracker', 'answer_correct')
 
+    def create(self, request, *args, **kwargs):
+        """
+        With settings.ANSWER_INGESTION set to 'queued', answers are
+        accepted onto the ingestion queue and written in batches, see
+        quizzes.ingestion. Answers are written straight away while Redis
+        is unavailable.
+        """
+        if settings.ANSWER_INGESTION != 'queued':
+            return super(AnswerViewSet, self).create(request, *args, **kwargs)
+        serializer = QueuedAnswerSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            answer_id = ingestion.enqueue(serializer.validated_data,
+                                          request.user)
+        except ingestion.QueueFull:
+            return Response(
+                {"detail": "Too many answers waiting to be recorded."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.ANSWER_QUEUE_RETRY)})
+        except RedisError:
+            logger.exception("Answer ingestion queue unavailable")
+            return super(AnswerViewSet, self).create(request, *args, **kwargs)
+        try:
+            if ingestion.request_drain():
+                IngestAnswers.apply_async()
+        except RedisError:
+            # The periodic drain picks the answer up
+            logger.exception("Answer ingestion drain not requested")
+        data = serializer.data
+        data['id'] = answer_id
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user,
                         updated_by=self.request.user)
@@ -76,89 +238,156 @@ class AnswerViewSet(viewsets.ModelViewSet):
         serializer.save(updated_by=self.request.user)
 
 
-class TrackerViewSet(viewsets.ModelViewSet):
+class TrackerViewSet(IdempotentMixin, ThrottleFirstMixin, SparseFieldsMixin,
+                     ValuesListMixin, viewsets.ModelViewSet):
 
     """
     API endpoint that allows Tracker models to be viewed or edited.
     """
     permission_classes = (IsAuthenticated,)
+    throttle_scope = 'tracker'
     queryset = Tracker.objects.all()
     serializer_class = TrackerSerializer
-    filter_fields = ('identity', 'quiz', 'complete', 'started_at',
-                     'completed_at')
+    filter_fields = ('identity', 'quiz', 'complete', 'abandoned',
+                     'started_at', 'completed_at')
+    json_filter_fields = ('metadata',)
 
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user,
-                        updated_by=self.request.user)
+        try:
+            with transaction.atomic():
+                serializer.save(created_by=self.request.user,
+                                updated_by=self.request.user)
+        except IntegrityError:
+            raise serializers.ValidationError({
+                "non_field_errors": [
+                    "This identity already has an incomplete tracker for "
+                    "this quiz, use tracker/get-or-create instead."]})
 
     def perform_update(self, serializer):
-        serializer.save(updated_by=self.request.user)
-
-
-class QuizzesUntaken(generics.ListAPIView):
+        # Reopening a tracker can clash with the identity's active one
+        try:
+            with transaction.atomic():
+                serializer.save(updated_by=self.request.user)
+        except IntegrityError:
+            raise serializers.ValidationError({
+                "non_field_errors": [
+                    "This identity already has an incomplete tracker for "
+                    "this quiz."]})
+
+    @list_route(methods=['post'], url_path='get-or-create')
+    def get_or_create(self, request):
+        """
+        Returns the incomplete tracker of the identity for the quiz,
+        creating it if there is none, so retries are idempotent.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        tracker, created = Tracker.objects.get_or_create_active(
+            identity=data['identity'], quiz=data['quiz'],
+            metadata=data.get('metadata'), created_by=request.user,
+            updated_by=request.user)
+        return Response(
+            self.get_serializer(tracker).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class QuizzesUntaken(ThrottleFirstMixin, SparseFieldsMixin, ValuesListMixin,
+                     generics.ListAPIView):
     permission_classes = (IsAuthenticated,)
+    throttle_scope = 'quiz-untaken'
     serializer_class = QuizSerializer
+    json_filter_fields = ('metadata',)
 
     def get_queryset(self):
         """
         This view should return a list of all the quizzes the identity in
-        query parameters hasn't taken.
+        query parameters hasn't taken, archived trackers included.
         Always excludes quizzes with active = False
         """
         identity_id = self.request.query_params['identity']
-        taken = Tracker.objects.filter(
-            complete=True, identity=identity_id).values_list('quiz', flat=True)
-        return Quiz.objects.filter(active=True).exclude(id__in=taken)
+        quizzes = Quiz.objects.with_questions().filter(active=True)
+        for model in (Tracker, TrackerArchive):
+            quizzes = quizzes.exclude(id__in=model.objects.filter(
+                complete=True, identity=identity_id).values_list(
+                'quiz', flat=True))
+        return quizzes
 
 
-class QuizResultsCSV(APIView):
+class QuizResultsCSV(ThrottleFirstMixin, APIView):
     permission_classes = (IsAuthenticated,)
+    throttle_scope = 'tracker-export'
     renderer_classes = (r.CSVRenderer, )
 
     def get(self, request, format=None):
         """
-        Return a list of all results.
-        """
-        results = Tracker.objects.all()
-        content = []
-        for tracker in results:
-            base = {
-                "tracker": tracker.id,
-                "quiz": tracker.quiz_id,
-                "identity": str(tracker.identity),
-                "quiz_started_at": tracker.started_at,
-                "quiz_complete": tracker.complete,
-                "quiz_completed_at": tracker.completed_at
-            }
-            answers = tracker.answers.all()
-            if answers.count() > 0:
-                for answer in answers:
-                    line = base.copy()
-                    line.update({
-                        "question_id": answer.question_id,
-                        "question_text": answer.question_text,
-                        "answer_text": answer.answer_text,
-                        "answer_value": answer.answer_value,
-                        "answer_correct": answer.answer_correct,
-                        "answer_created_at": answer.created_at
-                    })
-                    content.append(line)
-        return Response(content)
-
-
-class StatsView(APIView):
+        Return a list of all results, archived trackers' included.
+        Optionally restricted to trackers started within the
+        `started_at__gte` and `started_at__lt` query parameters, which keeps
+        the scan on the started_at index. Large exports should be run as
+        export jobs instead.
+        """
+        window = {}
+        for param in ('started_at__gte', 'started_at__lt'):
+            value = request.query_params.get(param)
+            if value:
+                value = serializers.DateTimeField().to_internal_value(value)
+                window[param] = value
+        return Response(exports.export_rows(**window))
+
+
+class ExportJobViewSet(IdempotentMixin, ThrottleFirstMixin, SparseFieldsMixin,
+                       mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                       mixins.ListModelMixin, viewsets.GenericViewSet):
+
+    """
+    Runs tracker results exports in the background. POST queues an export
+    as `csv`, `ndjson` or `parquet`, optionally restricted to a quiz and to
+    the `started_at__gte` and `started_at__lt` window, GET reports its
+    progress and, once complete, the link to download the file from.
+    """
+    permission_classes = (IsAuthenticated,)
+    throttle_scope = 'export'
+    queryset = ExportJob.objects.all()
+    serializer_class = ExportJobSerializer
+    filter_fields = ('quiz', 'status')
+
+    def perform_create(self, serializer):
+        job = serializer.save(created_by=self.request.user)
+        ExportAnswers.apply_async(kwargs={'job_id': str(job.id)})
+
+    @detail_route(methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ExportJob.COMPLETE:
+            return Response(
+                {"detail": "Export job is %s." % job.status},
+                status=status.HTTP_409_CONFLICT)
+        writer = exports.WRITERS[job.format]
+        response = FileResponse(
+            job.file.storage.open(job.file.name, 'rb'),
+            content_type=writer.content_type)
+        response['Content-Disposition'] = (
+            'attachment; filename="export-%s.%s"' % (
+                job.id, writer.extension))
+        return response
+
+
+class StatsView(ThrottleFirstMixin, APIView):
 
     """ Stats view
         GET - returns some key stat
     """
     permission_classes = (IsAuthenticated,)
+    throttle_scope = 'stats'
 
     def get(self, request, *args, **kwargs):
+        # Both tables are indexed on these timestamps so the last 30 days
+        # are an index range scan rather than a full table scan
+        since = timezone.now() - timedelta(days=30)
         tracker_complete = Tracker.objects.filter(
-            complete=True,
-            completed_at__gte=datetime.now()-timedelta(days=30)).count()
-        answers = Answer.objects.filter(
-            created_at__gte=datetime.now()-timedelta(days=30))
+            complete=True, completed_at__gte=since).count()
+        answers = Answer.objects.filter(created_at__gte=since)
         answers_correct = answers.filter(answer_correct=True).count()
         answers_incorrect = answers.filter(answer_correct=False).count()
         status = 200
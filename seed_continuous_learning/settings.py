@@ -9,9 +9,11 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
+from datetime import timedelta
 
 import dj_database_url
 import djcelery
+from celery.schedules import crontab
 from kombu import Exchange, Queue
 
 
@@ -49,12 +51,16 @@ INSTALLED_APPS = (
     'rest_framework.authtoken',
     'django_filters',
     'rest_hooks',
+    'djcelery',
     # us
     'quizzes',
 
 )
 
 MIDDLEWARE_CLASSES = (
+    'quizzes.middleware.MetricsMiddleware',
+    'quizzes.middleware.CompressionMiddleware',
+    'quizzes.middleware.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -79,6 +85,22 @@ DATABASES = {
             'postgres://postgres:@localhost/seed_continuous_learning')),
 }
 
+# Optional read replicas of the primary, a comma separated list of URLs.
+# Reads from GET requests and exports go to them, see quizzes.routers.
+REPLICA_DATABASES = []
+for number, url in enumerate(filter(None, os.environ.get(
+        'REPLICA_DATABASE_URLS', '').split(','))):
+    alias = 'replica%s' % number
+    DATABASES[alias] = dj_database_url.parse(url.strip())
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['quizzes.routers.ReplicaRouter']
+
+# Clients read from the primary for this many seconds after writing, so
+# they see their writes whatever the replicas' lag
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.9/topics/i18n/
@@ -102,8 +124,17 @@ STATICFILES_FINDERS = (
     'django.contrib.staticfiles.finders.FileSystemFinder',
 )
 
-STATIC_ROOT = 'staticfiles'
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATIC_URL = '/static/'
+# collectstatic writes content hashed copies of every file, and gzipped
+# copies of those, which WhiteNoise (see wsgi.py) serves from memory
+# with far future cache headers without going through Django
+STATICFILES_STORAGE = 'whitenoise.django.GzipManifestStaticFilesStorage'
+
+# Export files are written to the default file storage; point
+# DEFAULT_FILE_STORAGE at object storage in production
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+MEDIA_URL = '/media/'
 
 # TEMPLATE_CONTEXT_PROCESSORS = (
 #     "django.core.context_processors.request",
@@ -128,20 +159,53 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
-    'DEFAULT_FILTER_BACKENDS': ('rest_framework.filters.DjangoFilterBackend',)
+    'DEFAULT_FILTER_BACKENDS': (
+        'rest_framework.filters.DjangoFilterBackend',
+        'quizzes.filters.JSONFieldFilterBackend',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'quizzes.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'quizzes.throttling.TokenRateThrottle',
+        'quizzes.throttling.IdentityRateThrottle',
+    ),
 }
 
 # Webhook event definition
 HOOK_EVENTS = {
     # 'any.event.name': 'App.Model.Action' (created/updated/deleted)
-    'quiz.created': 'quizzes.quiz.created',
-    'question.created': 'quizzes.question.created',
+    'quiz.created': 'quizzes.Quiz.created',
+    'question.created': 'quizzes.Question.created',
 }
 
-HOOK_DELIVERER = 'seed_continuous_learning.tasks.deliver_hook_wrapper'
+HOOK_DELIVERER = 'quizzes.tasks.deliver_hook_wrapper'
+
+# Processes notice hooks added, changed or removed within this many
+# seconds, see quizzes.hooks
+HOOK_CACHE_SECONDS = int(os.environ.get('HOOK_CACHE_SECONDS', 5))
 
 HOOK_AUTH_TOKEN = os.environ.get('HOOK_AUTH_TOKEN', 'REPLACEME')
 
+# Hook deliveries go through an outbox table, relayed to Celery this many
+# at a time by the RelayHookEvents task every HOOK_RELAY_INTERVAL seconds,
+# or with less delay by a long running relay_hook_events command
+HOOK_RELAY_BATCH_SIZE = int(os.environ.get('HOOK_RELAY_BATCH_SIZE', 500))
+HOOK_RELAY_INTERVAL = int(os.environ.get('HOOK_RELAY_INTERVAL', 5))
+
+# Seconds to wait for a hook target to connect and to respond
+HOOK_TIMEOUT = (3.05, float(os.environ.get('HOOK_TIMEOUT', 10)))
+
+# A target's circuit opens after this many failed deliveries within the
+# window, deliveries to it waiting for the reset before one is tried
+# again, and being dropped after this many waits
+HOOK_CIRCUIT_FAILURES = int(os.environ.get('HOOK_CIRCUIT_FAILURES', 5))
+HOOK_CIRCUIT_WINDOW = 60
+HOOK_CIRCUIT_RESET_SECONDS = int(
+    os.environ.get('HOOK_CIRCUIT_RESET_SECONDS', 30))
+HOOK_DEFER_RETRIES = int(os.environ.get('HOOK_DEFER_RETRIES', 120))
+
 # Celery configuration options
 CELERY_RESULT_BACKEND = 'djcelery.backends.database:DatabaseBackend'
 CELERYBEAT_SCHEDULER = 'djcelery.schedulers.DatabaseScheduler'
@@ -149,10 +213,16 @@ CELERYBEAT_SCHEDULER = 'djcelery.schedulers.DatabaseScheduler'
 BROKER_URL = os.environ.get('BROKER_URL', 'redis://localhost:6379/0')
 
 CELERY_DEFAULT_QUEUE = 'seed_continuous_learning'
+# Workers started without -Q consume every queue declared here, which
+# must include each queue in CELERY_ROUTES
 CELERY_QUEUES = (
     Queue('seed_continuous_learning',
           Exchange('seed_continuous_learning'),
           routing_key='seed_continuous_learning'),
+    Queue('priority', Exchange('priority'), routing_key='priority'),
+    Queue('mediumpriority', Exchange('mediumpriority'),
+          routing_key='mediumpriority'),
+    Queue('exports', Exchange('exports'), routing_key='exports'),
 )
 
 CELERY_ALWAYS_EAGER = False
@@ -167,9 +237,32 @@ CELERY_ROUTES = {
     'celery.backend_cleanup': {
         'queue': 'mediumpriority',
     },
-    'quizzes.tasks.deliver_hook_wrapper': {
+    'quizzes.tasks.DeliverHook': {
         'queue': 'priority',
     },
+    'quizzes.tasks.ExportAnswers': {
+        'queue': 'exports',
+    },
+}
+
+CELERYBEAT_SCHEDULE = {
+    'archive-trackers': {
+        'task': 'quizzes.tasks.ArchiveTrackers',
+        'schedule': crontab(minute=0, hour=2),
+    },
+    'expire-trackers': {
+        'task': 'quizzes.tasks.ExpireTrackers',
+        'schedule': crontab(minute=30),
+    },
+    'relay-hook-events': {
+        'task': 'quizzes.tasks.RelayHookEvents',
+        'schedule': timedelta(seconds=HOOK_RELAY_INTERVAL),
+    },
+    # Catches queued answers whose drain couldn't be requested
+    'ingest-answers': {
+        'task': 'quizzes.tasks.IngestAnswers',
+        'schedule': crontab(),
+    },
 }
 
 CELERY_TASK_SERIALIZER = 'json'
@@ -177,3 +270,65 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_ACCEPT_CONTENT = ['json']
 
 djcelery.setup_loader()
+
+# Redis for request-path state (idempotency keys etc), defaults to the
+# Celery broker's Redis
+REDIS_URL = os.environ.get('REDIS_URL', BROKER_URL)
+REDIS_CLIENT_CLASS = 'redis.StrictRedis'
+
+# Responses to requests carrying an Idempotency-Key header are replayed
+# for retries within this many seconds
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_LOCK_TTL = 60
+
+# Request rates counted in Redis, per client token ('token') and per
+# learner identity ('identity'). '<kind>:<scope>' sets the rate for an
+# endpoint, scopes being a view's throttle_scope and, on viewsets, the
+# action, e.g. 'answer-create'. Requests without a rate aren't limited.
+THROTTLE_RATES = {
+    'token': os.environ.get('THROTTLE_TOKEN_RATE', '6000/min'),
+    'identity:answer-create': os.environ.get(
+        'THROTTLE_IDENTITY_ANSWER_RATE', '60/min'),
+    'identity:quiz-untaken': os.environ.get(
+        'THROTTLE_IDENTITY_UNTAKEN_RATE', '60/min'),
+    'identity:tracker-get_or_create': os.environ.get(
+        'THROTTLE_IDENTITY_TRACKER_RATE', '60/min'),
+}
+
+# /metrics is only served to requests with an "Authorization: Bearer
+# <METRICS_TOKEN>" header, and not at all without a token
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Trackers (and their answers) older than this are moved to the archive
+# tables nightly to keep the hot tables small
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))
+
+# Incomplete trackers without activity for this long are marked abandoned
+ABANDON_AFTER_HOURS = int(os.environ.get('ABANDON_AFTER_HOURS', 72))
+ABANDON_BATCH_SIZE = int(os.environ.get('ABANDON_BATCH_SIZE', 1000))
+
+# Rows export jobs fetch and write at a time, a row group in Parquet
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 20000))
+
+# 'queued' accepts answers onto a Redis queue drained into the database in
+# batches, see quizzes.ingestion; 'direct' writes each as it is posted
+ANSWER_INGESTION = os.environ.get('ANSWER_INGESTION', 'direct')
+ANSWER_INGEST_BATCH_SIZE = int(os.environ.get('ANSWER_INGEST_BATCH_SIZE', 500))
+# Answers are refused with a 503, to retry after ANSWER_QUEUE_RETRY
+# seconds, while this many are waiting
+ANSWER_QUEUE_MAX_LENGTH = int(os.environ.get('ANSWER_QUEUE_MAX_LENGTH',
+                                             100000))
+ANSWER_QUEUE_RETRY = int(os.environ.get('ANSWER_QUEUE_RETRY', 5))
+ANSWER_INGEST_LOCK_SECONDS = 60
+# Drains a batch fails before its answers are written one by one and the
+# failing ones dead lettered
+ANSWER_INGEST_MAX_FAILURES = int(os.environ.get('ANSWER_INGEST_MAX_FAILURES',
+                                                3))
+
+# Responses are compressed, with brotli when it is installed and accepted,
+# from this size in bytes; smaller ones aren't worth the time
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+# Brotli quality 0-11; the top levels are far too slow for dynamic content
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get(
+    'COMPRESSION_BROTLI_QUALITY', 4))
@@ -1,3 +1,5 @@
+import tempfile
+
 from seed_continuous_learning.settings import *  # flake8: noqa
 
 # SECURITY WARNING: keep the secret key used in production secret!
@@ -12,3 +14,10 @@ CELERY_EAGER_PROPAGATES_EXCEPTIONS = True
 CELERY_ALWAYS_EAGER = True
 BROKER_BACKEND = 'memory'
 CELERY_RESULT_BACKEND = 'djcelery.backends.database:DatabaseBackend'
+
+REDIS_CLIENT_CLASS = 'fakeredis.FakeStrictRedis'
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+# Tests don't run collectstatic, so there is no manifest to look up
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
@@ -1,6 +1,7 @@
 import os
 from django.conf.urls import patterns, include, url
 from django.contrib import admin
+from quizzes.metrics import metrics_view
 
 admin.site.site_header = os.environ.get('CONTINUOUS_LEARNING_TITLE',
                                         'Seed Continuous Learning Admin')
@@ -9,6 +10,7 @@ admin.site.site_header = os.environ.get('CONTINUOUS_LEARNING_TITLE',
 urlpatterns = patterns(
     '',
     url(r'^admin/',  include(admin.site.urls)),
+    url(r'^metrics$', metrics_view, name='metrics'),
     url(r'^api/auth/',
         include('rest_framework.urls', namespace='rest_framework')),
     url(r'^api/token-auth/',
@@ -23,8 +23,13 @@ setup(
         'django-celery==3.1.17',
         'redis==2.10.5',
         'pytz==2015.7',
-        'django-rest-hooks==1.2.1'
+        'django-rest-hooks==1.2.1',
+        'prometheus_client==0.7.1'
     ],
+    extras_require={
+        'brotli': ['Brotli==1.0.9'],
+        'parquet': ['pyarrow==0.16.0'],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Framework :: Django',